@@ -0,0 +1,207 @@
+"""
+Computes calibration curves and scores (see metrics.py) for many users at once,
+without Streamlit, plotly or Firestore.
+
+    python batch.py --uids 28899 12345 --curl curl.txt --out report --format parquet
+    python batch.py --dump scraped.json --out report --format csv
+    python batch.py --snapshot snapshots --out report  # see snapshots.py
+
+Writes {out}_summary.{format} (one row per user) and {out}_curves.{format}
+(one row per user and bin).
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+import uncurl
+
+import snapshots
+
+from calibration import calibration_curve
+from forecast_store import ForecastStore
+from gjo_requests import async_stream_user_data, configure_parsing
+from metrics import scores
+from scheduler import FetchError, configure_http_cache
+
+CURVE_COLUMNS = ["uid", "bin", "prob_pred", "prob_true", "count"]
+
+PLATFORM_URLS = {
+    "gjo": "https://www.gjopen.com",
+    "cset": "https://www.cset-foretell.com",
+}
+
+
+async def scrape_users(uids, platform_url, headers, cookies, n_concurrent_users=2):
+    """
+    Returns {uid: [(qid, forecasts, resolution), ...]}, the format of the dumps.
+    Users whose scores pages cannot be fetched (e.g. a wrong uid) are skipped.
+    """
+    semaphore = asyncio.Semaphore(n_concurrent_users)
+
+    async def scrape(uid):
+        async with semaphore:
+            logging.info(f"[ ] scrape_users for uid={uid}")
+            try:
+                user_data = [
+                    item
+                    async for item in async_stream_user_data(uid, platform_url, headers, cookies)
+                ]
+            except FetchError as e:
+                logging.error(f"scrape_users skips uid={uid} | {e}")
+                return None
+            logging.info(f"[X] scrape_users for uid={uid}")
+            return user_data
+
+    users_data = await asyncio.gather(*[scrape(uid) for uid in uids])
+    return {uid: user_data for uid, user_data in zip(uids, users_data) if user_data is not None}
+
+
+def calibrate_user(uid, load_store, n_bins, strategy):
+    store = load_store()
+    y_true, y_pred, _ = store.binary(drop_last=True)
+
+    summary = {
+        "uid": uid,
+        "n_questions": store.n_questions,
+        "n_forecasts": store.n_forecasts,
+        "n_datapoints": len(y_pred),
+        **scores(y_true, y_pred, n_bins=n_bins, strategy=strategy),
+    }
+
+    curve = pd.DataFrame(columns=CURVE_COLUMNS)
+    if len(y_pred):
+        prob_true, prob_pred, counts = calibration_curve(
+            y_true, y_pred, n_bins=n_bins, strategy=strategy
+        )
+        curve = pd.DataFrame(
+            {
+                "uid": uid,
+                "bin": np.arange(len(counts)),
+                "prob_pred": prob_pred,
+                "prob_true": prob_true,
+                "count": counts,
+            }
+        )
+
+    return summary, curve
+
+
+def calibrate_users(stores, n_bins, strategy, workers=None):
+    """
+    `stores` maps user ids to picklable functions returning their `ForecastStore`,
+    called in the worker processes.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(calibrate_user, uid, load_store, n_bins, strategy)
+            for uid, load_store in stores.items()
+        ]
+        results = [future.result() for future in futures]
+
+    summaries = pd.DataFrame([summary for summary, _ in results])
+    curves = pd.DataFrame(columns=CURVE_COLUMNS)
+    if results:
+        curves = pd.concat([curve for _, curve in results], ignore_index=True)
+    return summaries, curves
+
+
+def write_table(table, path, fmt):
+    if fmt == "csv":
+        table.to_csv(path, index=False)
+    elif fmt == "json":
+        table.to_json(path, orient="records")
+    elif fmt == "parquet":
+        table.to_parquet(path, index=False)
+
+
+def load_dump(path):
+    with open(path) as f:
+        return {uid: [tuple(item) for item in user_data] for uid, user_data in json.load(f).items()}
+
+
+def save_dump(users_data, path):
+    with open(path, "w") as f:
+        json.dump(users_data, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--uids", nargs="+", help="user ids to scrape")
+    source.add_argument("--uids-file", help="a file with one user id per line")
+    source.add_argument("--dump", help="a JSON dump of already scraped users, see --save-dump")
+    source.add_argument("--snapshot", help="a snapshot directory of scraped users, see --save-snapshot")
+    parser.add_argument("--platform", choices=sorted(PLATFORM_URLS), default="gjo")
+    parser.add_argument("--curl", help="a file with a cURL command to take headers and cookies from")
+    parser.add_argument("--save-dump", help="where to save the scraped data as JSON")
+    parser.add_argument("--save-snapshot", help="a directory to save the scraped data in as Arrow files")
+    parser.add_argument("--http-cache", help="a SQLite file to cache and revalidate scraped pages in")
+    parser.add_argument("--parse-workers", type=int, default=0, help="processes parsing pages (default: inline)")
+    parser.add_argument("--n-bins", type=int, default=21)
+    parser.add_argument("--strategy", choices=["uniform", "quantile"], default="uniform")
+    parser.add_argument("--workers", type=int, help="number of processes (default: all CPUs)")
+    parser.add_argument("--out", default="calibration")
+    parser.add_argument("--format", choices=["csv", "json", "parquet"], default="csv")
+    args = parser.parse_args()
+
+    if args.format == "parquet" or args.snapshot or args.save_snapshot:
+        try:
+            import pyarrow
+        except ImportError:
+            parser.error("--format parquet, --snapshot and --save-snapshot need pyarrow: pip install pyarrow")
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.snapshot:
+        # every worker memory-maps the files of its users itself
+        users_data = None
+        stores = {
+            uid: functools.partial(snapshots.load_store, args.snapshot, args.platform, uid)
+            for uid in snapshots.list_uids(args.snapshot, args.platform)
+        }
+    elif args.dump:
+        users_data = load_dump(args.dump)
+    else:
+        uids = args.uids
+        if args.uids_file:
+            with open(args.uids_file) as f:
+                uids = [line.strip() for line in f if line.strip()]
+
+        if args.http_cache:
+            configure_http_cache(args.http_cache)
+        configure_parsing(args.parse_workers)
+
+        headers, cookies = dict(), dict()
+        if args.curl:
+            with open(args.curl) as f:
+                curl_content = uncurl.parse_context(f.read().replace("\\", ""))
+            headers, cookies = curl_content.headers, curl_content.cookies
+
+        users_data = asyncio.run(
+            scrape_users(uids, PLATFORM_URLS[args.platform], headers, cookies)
+        )
+        if args.save_dump:
+            save_dump(users_data, args.save_dump)
+
+    if users_data is not None:
+        if args.save_snapshot:
+            snapshots.export_user_data(users_data, args.save_snapshot, args.platform)
+        stores = {
+            uid: functools.partial(ForecastStore.from_stream, user_data)
+            for uid, user_data in users_data.items()
+        }
+
+    summaries, curves = calibrate_users(stores, args.n_bins, args.strategy, args.workers)
+
+    write_table(summaries, f"{args.out}_summary.{args.format}", args.format)
+    write_table(curves, f"{args.out}_curves.{args.format}", args.format)
+    logging.info(f"Wrote {args.out}_summary.{args.format} and {args.out}_curves.{args.format}")
+
+
+if __name__ == "__main__":
+    main()
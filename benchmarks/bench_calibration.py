@@ -0,0 +1,24 @@
+import numpy as np
+
+from calibration import CalibrationEngine, calibration_curve
+
+rng = np.random.default_rng(0)
+y_prob = np.round(rng.random(100_000), 2)
+y_true = (rng.random(100_000) < y_prob).astype(float)
+engine = CalibrationEngine(y_true, y_prob)
+
+
+def time_calibration_curve_uniform():
+    calibration_curve(y_true, y_prob, n_bins=21, strategy="uniform")
+
+
+def time_calibration_curve_quantile():
+    calibration_curve(y_true, y_prob, n_bins=316, strategy="quantile")
+
+
+def time_engine_build():
+    CalibrationEngine(y_true, y_prob)
+
+
+def time_engine_curve_sweep():
+    engine.curves(range(1, 301), strategy="quantile")
@@ -0,0 +1,65 @@
+"""
+Cold-start cost: importing a module in a fresh interpreter (interpreter startup
+included).
+
+    python -m benchmarks.bench_importtime strmlt  # the slowest imports of strmlt
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_in_subprocess(module, *flags):
+    return subprocess.run(
+        [sys.executable, *flags, "-c", f"import {module}"],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+
+def time_import_gjo_requests():
+    import_in_subprocess("gjo_requests")
+
+
+def time_import_calibration():
+    import_in_subprocess("calibration")
+
+
+def time_import_plotting():
+    import_in_subprocess("plotting")
+
+
+def time_import_firebase_requests():
+    import_in_subprocess("firebase_requests")
+
+
+def time_import_strmlt():
+    import_in_subprocess("strmlt")
+
+
+def slowest_imports(module, n=20):
+    """
+    [(cumulative seconds, imported module), ...] from `python -X importtime`.
+    """
+    stderr = import_in_subprocess(module, "-X", "importtime").stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        imports.append((int(cumulative) / 1e6, name.rstrip()))
+    return sorted(imports, reverse=True)[:n]
+
+
+def main():
+    module = sys.argv[1] if len(sys.argv) > 1 else "strmlt"
+    for seconds, name in slowest_imports(module):
+        print(f"{1000 * seconds:>10.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compares gjo_requests._extract_forecasts_from_page with the BeautifulSoup
+based parser it replaced, both for equality of the results and for speed.
+
+    python -m benchmarks.bench_parsing
+
+The time_* functions are run by benchmarks.run.
+"""
+import re
+import timeit
+
+from bs4 import BeautifulSoup
+
+from benchmarks import fixtures
+from gjo_requests import _extract_forecasts_from_page, _extract_resolution_from_page
+
+
+def reference_extract_forecasts_from_page(page):
+    soup = BeautifulSoup(page, "html.parser")
+    soup_predictions = soup.find_all("div", {"class": "prediction-values"})
+    predictions = [re.findall("\n\s*(\d+)%", p_tag.text) for p_tag in soup_predictions]
+    predictions = [tuple(int(prob) / 100 for prob in pred) for pred in predictions]
+    predictions = [
+        (pred[0], 1 - pred[0]) if len(pred) == 1 else pred for pred in predictions
+    ]
+
+    timestamps = []
+    looking_for_a_forecast = True
+    for line in page.split("\n"):
+        if looking_for_a_forecast:
+            hit = re.findall("made their \d+(st|nd|rd|th) forecast", line)
+            if hit:
+                looking_for_a_forecast = False
+
+        else:
+            hit = re.findall('<span data-localizable-timestamp="([^"]+)">', line)
+            if hit:
+                timestamps.extend(hit)
+                looking_for_a_forecast = True
+
+    return [
+        {"y_pred": pred, "timestamp": timestamp}
+        for pred, timestamp in zip(predictions, timestamps)
+    ]
+
+
+PAGES = {
+    "empty": fixtures.empty_forecast_page(),
+    "binary, 10 forecasts": fixtures.forecast_page(10, n_options=2, seed=1),
+    "5 options, 10 forecasts": fixtures.forecast_page(10, n_options=5, seed=2),
+    "binary, 100 forecasts": fixtures.forecast_page(100, n_options=2, seed=3),
+    "12 options, 100 forecasts": fixtures.forecast_page(100, n_options=12, seed=4),
+}
+
+
+def check_equivalence():
+    for name, page in PAGES.items():
+        expected = reference_extract_forecasts_from_page(page)
+        actual = _extract_forecasts_from_page(page)
+        assert actual == expected, f"parsers disagree on {name!r}"
+
+    for seed in range(200):
+        page = fixtures.forecast_page(1 + seed % 7, n_options=2 + seed % 4, seed=seed)
+        assert _extract_forecasts_from_page(page) == reference_extract_forecasts_from_page(page)
+
+
+BINARY_PAGE = PAGES["binary, 100 forecasts"]
+MULTIPLE_CHOICE_PAGE = PAGES["12 options, 100 forecasts"]
+QUESTION_PAGE = fixtures.question_page(n_options=5, outcome=2)
+
+
+def time_extract_forecasts_binary():
+    _extract_forecasts_from_page(BINARY_PAGE)
+
+
+def time_extract_forecasts_multiple_choice():
+    _extract_forecasts_from_page(MULTIPLE_CHOICE_PAGE)
+
+
+def time_extract_resolution():
+    _extract_resolution_from_page(QUESTION_PAGE)
+
+
+def main(number=20):
+    check_equivalence()
+
+    print(f"{'page':<28}{'soup, ms':>12}{'single pass, ms':>18}{'speedup':>10}")
+    for name, page in PAGES.items():
+        reference = timeit.timeit(lambda: reference_extract_forecasts_from_page(page), number=number)
+        current = timeit.timeit(lambda: _extract_forecasts_from_page(page), number=number)
+        print(
+            f"{name:<28}{1000 * reference / number:>12.3f}"
+            f"{1000 * current / number:>18.3f}{reference / current:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
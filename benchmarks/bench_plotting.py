@@ -0,0 +1,15 @@
+import numpy as np
+
+from plotting import plotly_calibration, plotly_calibration_odds
+
+rng = np.random.default_rng(0)
+y_pred = np.round(rng.random(100_000), 2)
+y_true = (rng.random(100_000) < y_pred).astype(float)
+
+
+def time_plotly_calibration():
+    plotly_calibration(y_true, y_pred, n_bins=21, strategy="uniform")
+
+
+def time_plotly_calibration_odds():
+    plotly_calibration_odds(y_true, y_pred, n_bins=21, strategy="uniform")
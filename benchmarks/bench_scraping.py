@@ -0,0 +1,45 @@
+"""
+Scrapers against the local mock server (no latency, so this measures the
+client side: scheduling, HTTP handling and parsing).
+"""
+import os
+import tempfile
+
+from benchmarks.mock_server import MockGJO
+from gjo_requests import get_resolved_questions, request_forecasts, request_resolutions
+from scheduler import configure_http_cache
+
+mock = MockGJO(n_questions=100, questions_per_page=20, forecast_pages=2, forecasts_per_page=10)
+etag_mock = MockGJO(
+    n_questions=100, questions_per_page=20, forecast_pages=2, forecasts_per_page=10, etags=True
+)
+url, etag_url = None, None
+http_cache_path = os.path.join(tempfile.mkdtemp(), "http_cache.sqlite")
+
+
+def setup():
+    global url, etag_url
+    if url is None:
+        url = mock.start_in_thread()
+        etag_url = etag_mock.start_in_thread()
+
+
+def time_get_resolved_questions():
+    get_resolved_questions.__wrapped__("1", url, {}, {})
+
+
+def time_request_forecasts():
+    request_forecasts("1", mock.qids[:20], url, {}, {})
+
+
+def time_request_resolutions():
+    request_resolutions(mock.qids, url, {}, {})
+
+
+def time_request_forecasts_revalidated():
+    # after the first call every page is answered with 304 from the HTTP cache
+    configure_http_cache(http_cache_path)
+    try:
+        request_forecasts("1", etag_mock.qids[:20], etag_url, {}, {})
+    finally:
+        configure_http_cache(None)
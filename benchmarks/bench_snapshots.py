@@ -0,0 +1,46 @@
+"""
+Loading a user's forecasts from a snapshot (see snapshots.py) compared with
+building the store from scraped records.
+"""
+import tempfile
+
+import numpy as np
+
+import snapshots
+from forecast_store import ForecastStore
+
+rng = np.random.default_rng(0)
+user_data = []
+for i in range(1000):
+    n_options = (2, 2, 3, 5)[i % 4]
+    forecasts = [
+        {
+            "y_pred": tuple(np.round(rng.dirichlet(np.ones(n_options)), 2).tolist()),
+            "timestamp": f"2021-03-{1 + j % 28:02d}T12:{i % 60:02d}:00Z",
+            "page": 1 + j // 10,
+        }
+        for j in range(20)
+    ]
+    user_data.append((str(1000 + i), forecasts, {"y_true": tuple(int(k == 0) for k in range(n_options))}))
+
+root = None
+
+
+def setup():
+    global root
+    if root is None:
+        root = tempfile.mkdtemp()
+        snapshots.export_user_data({"arrow": user_data}, root, "gjo", "arrow")
+        snapshots.export_user_data({"parquet": user_data}, root, "gjo", "parquet")
+
+
+def time_from_stream():
+    ForecastStore.from_stream(user_data)
+
+
+def time_load_store_arrow():
+    snapshots.load_store(root, "gjo", "arrow")
+
+
+def time_load_store_parquet():
+    snapshots.load_store(root, "gjo", "parquet")
@@ -0,0 +1,95 @@
+"""
+Synthetic pages mimicking the markup of Good Judgment Open, used by the
+benchmarks in place of live pages.
+"""
+import random
+
+_ORDINALS = {1: "st", 2: "nd", 3: "rd"}
+
+
+def _ordinal(n):
+    return "th" if 10 <= n % 100 <= 20 else _ORDINALS.get(n % 10, "th")
+
+
+def _probabilities(rng, n_options):
+    weights = [rng.random() for _ in range(n_options)]
+    probs = [int(100 * w / sum(weights)) for w in weights]
+    probs[-1] = 100 - sum(probs[:-1])
+    return probs
+
+
+def forecast_page(n_forecasts, n_options=2, seed=0, first_forecast=1):
+    """
+    A prediction_sets page with `n_forecasts` forecasts; binary questions show
+    only the probability of "Yes".
+    """
+    rng = random.Random(seed)
+    lines = ["<!DOCTYPE html>", "<html>", "<body>", '<div class="prediction-sets">']
+
+    for i in range(n_forecasts):
+        day = 1 + rng.randrange(28)
+        probs = _probabilities(rng, n_options)
+        shown = probs[:1] if n_options == 2 else probs
+
+        lines += [
+            '<div class="row prediction-set">',
+            '  <div class="prediction-set-info">',
+            f'    <a href="/memberships/{seed}">forecaster&nbsp;{seed}</a>',
+            f"    made their {first_forecast + i}{_ordinal(first_forecast + i)} forecast",
+            '    <span class="flyover-comment-date">',
+            f'      <span data-localizable-timestamp="2021-03-{day:02d}T12:{i % 60:02d}:00Z">Mar {day}, 2021</span>',
+            "    </span>",
+            "  </div>",
+            '  <div class="prediction-values clearfix">',
+        ]
+        for k, prob in enumerate(shown):
+            lines += [
+                '    <div class="row">',
+                '      <div class="col-xs-2 prediction-value">',
+                f"        {prob}%",
+                "      </div>",
+                f'      <div class="col-xs-10">Option &amp; answer {k}</div>',
+                "    </div>",
+            ]
+        lines += ["  </div>", "</div>"]
+
+    lines += ["</div>", "</body>", "</html>"]
+    return "\n".join(lines)
+
+
+def empty_forecast_page():
+    return forecast_page(0)
+
+
+def question_page(n_options=2, outcome=0):
+    """
+    A resolved question page: binary questions show "Yes"/"No", the others a
+    table where the right answer is marked with an icon.
+    """
+    if n_options == 2:
+        answer = "Yes" if outcome == 0 else "No"
+        inner = (
+            '<div class="binary-probability-value">Crowd forecast</div>\n'
+            f'<div class="binary-probability-value">Resolved: {answer}</div>'
+        )
+    else:
+        check = '<i class="fa fa-check"></i>'
+        rows = "\n".join(
+            f"<tr><td>Option {k}</td><td>{check if k == outcome else ''}</td></tr>"
+            for k in range(n_options)
+        )
+        inner = f"<table>\n<tr><th>Answer</th><th>Correct</th></tr>\n{rows}\n</table>"
+
+    return (
+        "<!DOCTYPE html>\n<html>\n<body>\n"
+        f'<div id="prediction-interface-container">\n{inner}\n</div>\n'
+        "</body>\n</html>"
+    )
+
+
+def scores_page(qids):
+    rows = "\n".join(
+        f'<tr><td><a href="/questions/{q}-some-question-title">Question {q}</a></td></tr>'
+        for q in qids
+    )
+    return f"<!DOCTYPE html>\n<html>\n<body>\n<table>\n{rows}\n</table>\n</body>\n</html>"
@@ -0,0 +1,168 @@
+"""
+A local stand-in for Good Judgment Open serving synthetic pages, with
+configurable sizes and latency.
+
+    python -m benchmarks.mock_server --questions 200 --latency 0.05
+
+then point the app or the scrapers at http://127.0.0.1:8000.
+"""
+import argparse
+import asyncio
+import hashlib
+import threading
+
+from aiohttp import web
+
+from benchmarks import fixtures
+
+
+class MockGJO:
+    """
+    Every user has forecasted on `n_questions` resolved questions, listed
+    `questions_per_page` per scores page; each question has `forecast_pages`
+    pages of `forecasts_per_page` forecasts. The number of options of a
+    question cycles through `options`. Every response is delayed by `latency`
+    seconds. With `etags` responses carry an ETag and conditional requests for
+    unchanged pages are answered with 304 Not Modified.
+    """
+
+    def __init__(
+        self,
+        n_questions=100,
+        questions_per_page=20,
+        forecast_pages=2,
+        forecasts_per_page=10,
+        options=(2, 2, 3, 5),
+        latency=0.0,
+        etags=False,
+    ):
+        self.n_questions = n_questions
+        self.questions_per_page = questions_per_page
+        self.forecast_pages = forecast_pages
+        self.forecasts_per_page = forecasts_per_page
+        self.options = options
+        self.latency = latency
+        self.etags = etags
+
+        self.qids = [str(1000 + i) for i in range(n_questions)]
+        self.n_requests = 0
+        self.n_not_modified = 0
+        self._runner = None
+        self.url = None
+
+    def n_options(self, qid):
+        return self.options[int(qid) % len(self.options)]
+
+    async def _respond(self, request, text):
+        self.n_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not self.etags:
+            return web.Response(text=text, content_type="text/html")
+
+        etag = f'"{hashlib.md5(text.encode()).hexdigest()}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.n_not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=text, content_type="text/html", headers={"ETag": etag})
+
+    def _questions_page(self, page_num):
+        start = (int(page_num) - 1) * self.questions_per_page
+        return fixtures.scores_page(self.qids[start : start + self.questions_per_page])
+
+    async def scores(self, request):
+        return await self._respond(request, self._questions_page(request.query.get("page", 1)))
+
+    async def resolved_questions(self, request):
+        return await self._respond(request, self._questions_page(request.query.get("page", 1)))
+
+    async def prediction_sets(self, request):
+        qid = request.match_info["qid"]
+        page_num = int(request.query.get("page", 1))
+
+        if page_num > self.forecast_pages:
+            return await self._respond(request, fixtures.empty_forecast_page())
+
+        return await self._respond(
+            request,
+            fixtures.forecast_page(
+                self.forecasts_per_page,
+                n_options=self.n_options(qid),
+                seed=int(qid) * 1000 + page_num,
+                first_forecast=1 + (page_num - 1) * self.forecasts_per_page,
+            ),
+        )
+
+    async def question(self, request):
+        qid = request.match_info["qid"]
+        n_options = self.n_options(qid)
+        return await self._respond(request, fixtures.question_page(n_options, int(qid) % n_options))
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/memberships/{uid}/scores/", self.scores)
+        app.router.add_get("/questions", self.resolved_questions)
+        app.router.add_get("/questions/{qid}/prediction_sets", self.prediction_sets)
+        app.router.add_get(r"/questions/{qid:\d+}", self.question)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def start_in_thread(self, host="127.0.0.1", port=0):
+        """
+        Serves from a daemon thread with its own event loop, for benchmarking
+        synchronous code; returns the base url.
+        """
+        started = threading.Event()
+        loop = asyncio.new_event_loop()
+
+        def serve():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.start(host, port))
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        started.wait()
+        return self.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--forecast-pages", type=int, default=2)
+    parser.add_argument("--forecasts-per-page", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--etags", action="store_true", help="answer conditional requests with 304")
+    args = parser.parse_args()
+
+    mock = MockGJO(
+        n_questions=args.questions,
+        forecast_pages=args.forecast_pages,
+        forecasts_per_page=args.forecasts_per_page,
+        latency=args.latency,
+        etags=args.etags,
+    )
+    web.run_app(mock.app(), host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Runs the time_* functions of the benchmark modules and compares them with the
+recorded baseline.
+
+    python -m benchmarks.run                 # compare with benchmarks/baseline.json
+    python -m benchmarks.run --save          # record a new baseline
+    python -m benchmarks.run -k calibration  # only benchmarks matching a substring
+
+Exits with 1 if a benchmark is slower than its baseline by more than the threshold.
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import timeit
+
+MODULES = [
+    "benchmarks.bench_parsing",
+    "benchmarks.bench_scraping",
+    "benchmarks.bench_calibration",
+    "benchmarks.bench_plotting",
+    "benchmarks.bench_importtime",
+    "benchmarks.bench_snapshots",
+]
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def collect(pattern=None):
+    for module_name in MODULES:
+        module = importlib.import_module(module_name)
+        for name in sorted(dir(module)):
+            full_name = f"{module_name.split('.')[-1]}.{name}"
+            if name.startswith("time_") and (pattern is None or pattern in full_name):
+                yield full_name, module, getattr(module, name)
+
+
+def measure(func, repeat=5, min_time=0.2):
+    """
+    The best time of a call over `repeat` rounds of at least `min_time` seconds.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("-k", dest="pattern", help="only run benchmarks containing this")
+    parser.add_argument("--save", action="store_true", help="record the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=1.5, help="allowed slowdown ratio")
+    args = parser.parse_args()
+
+    baseline = dict()
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    results, regressions = dict(), []
+    set_up = set()
+
+    print(f"{'benchmark':<52}{'time, ms':>12}{'baseline, ms':>15}{'ratio':>8}")
+    for name, module, func in collect(args.pattern):
+        if module not in set_up and hasattr(module, "setup"):
+            module.setup()
+        set_up.add(module)
+
+        results[name] = measure(func)
+
+        line = f"{name:<52}{1000 * results[name]:>12.3f}"
+        if name in baseline:
+            ratio = results[name] / baseline[name]
+            line += f"{1000 * baseline[name]:>15.3f}{ratio:>8.2f}"
+            if ratio > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    if args.save:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if regressions and not args.save:
+        print(f"{len(regressions)} benchmark(s) slower than the baseline: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+"""
+Storage for scraped data. Every backend maps
+
+    (platform, uid, qid) → forecast record {"forecasts": [...], "last_page": int, "complete": bool}
+    (platform, qid) → resolution {"y_true": [...]}
+    (platform, uid) → the ids of the user's resolved questions, as last listed
+
+and is safe to call from several threads. Resolutions are also listed by the
+time they were stored (`get_resolutions_since`, in `time.time()` seconds), so
+that readers can catch up with the writes of other processes incrementally.
+"""
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+BATCH_SIZE = 500  # maximum number of writes in a Firestore commit, of parameters in a query
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class CacheBackend:
+    in_memory = False  # whether bulk reads are worth copying into the backend
+
+    def get_forecasts(self, platform, uid, qids):
+        raise NotImplementedError
+
+    def put_forecasts(self, platform, uid, records):
+        raise NotImplementedError
+
+    def get_resolutions(self, platform, qids):
+        raise NotImplementedError
+
+    def put_resolutions(self, platform, resolutions):
+        raise NotImplementedError
+
+    def get_all_resolutions(self, platform):
+        raise NotImplementedError
+
+    def get_resolutions_since(self, platform, since):
+        """
+        The resolutions stored at or after `since`.
+        """
+        raise NotImplementedError
+
+    def get_questions(self, platform, uid):
+        """
+        The question ids stored for the user, or None.
+        """
+        raise NotImplementedError
+
+    def put_questions(self, platform, uid, qids):
+        raise NotImplementedError
+
+
+class MemoryLRUBackend(CacheBackend):
+    in_memory = True
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._stored_at = dict()  # {key: time.time()} of the resolutions
+        self._lock = threading.Lock()
+
+    def _get(self, keys):
+        found = dict()
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key[-1]] = self._entries[key]
+        return found
+
+    def _put(self, items, stored_at=None):
+        with self._lock:
+            for key, value in items:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                if stored_at is not None:
+                    self._stored_at[key] = stored_at
+            while len(self._entries) > self.maxsize:
+                key, _ = self._entries.popitem(last=False)
+                self._stored_at.pop(key, None)
+
+    def get_forecasts(self, platform, uid, qids):
+        return self._get(("forecasts", platform, uid, q) for q in qids)
+
+    def put_forecasts(self, platform, uid, records):
+        self._put((("forecasts", platform, uid, q), r) for q, r in records.items())
+
+    def get_resolutions(self, platform, qids):
+        return self._get(("resolutions", platform, q) for q in qids)
+
+    def put_resolutions(self, platform, resolutions):
+        self._put(
+            ((("resolutions", platform, q), r) for q, r in resolutions.items()), time.time()
+        )
+
+    def get_all_resolutions(self, platform):
+        with self._lock:
+            return {
+                key[-1]: value
+                for key, value in self._entries.items()
+                if key[:2] == ("resolutions", platform)
+            }
+
+    def get_resolutions_since(self, platform, since):
+        with self._lock:
+            return {
+                key[-1]: self._entries[key]
+                for key, stored_at in self._stored_at.items()
+                if key[1] == platform and stored_at >= since
+            }
+
+    def get_questions(self, platform, uid):
+        return self._get([("questions", platform, uid)]).get(uid)
+
+    def put_questions(self, platform, uid, qids):
+        self._put([(("questions", platform, uid), list(qids))])
+
+
+class SQLiteBackend(CacheBackend):
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS forecasts ("
+                "platform TEXT, uid TEXT, qid TEXT, record TEXT, "
+                "PRIMARY KEY (platform, uid, qid))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS resolutions ("
+                "platform TEXT, qid TEXT, resolution TEXT, stored_at REAL DEFAULT 0, "
+                "PRIMARY KEY (platform, qid))"
+            )
+            # caches made before resolutions were timed lack the column
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(resolutions)")]
+            if "stored_at" not in columns:
+                connection.execute("ALTER TABLE resolutions ADD COLUMN stored_at REAL DEFAULT 0")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS resolutions_stored_at "
+                "ON resolutions (platform, stored_at)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS questions ("
+                "platform TEXT, uid TEXT, qids TEXT, "
+                "PRIMARY KEY (platform, uid))"
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _select(self, query, params, qids):
+        found = dict()
+        with self._lock:
+            connection = self._connect()
+            for chunk in _chunks(qids, BATCH_SIZE):
+                placeholders = ", ".join("?" * len(chunk))
+                rows = connection.execute(
+                    query.format(placeholders=placeholders), (*params, *chunk)
+                )
+                found.update((qid, json.loads(value)) for qid, value in rows)
+        return found
+
+    def _insert(self, query, rows):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(query, rows)
+
+    def get_forecasts(self, platform, uid, qids):
+        return self._select(
+            "SELECT qid, record FROM forecasts "
+            "WHERE platform = ? AND uid = ? AND qid IN ({placeholders})",
+            (platform, uid),
+            qids,
+        )
+
+    def put_forecasts(self, platform, uid, records):
+        self._insert(
+            "INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?)",
+            [(platform, uid, q, json.dumps(r)) for q, r in records.items()],
+        )
+
+    def get_resolutions(self, platform, qids):
+        return self._select(
+            "SELECT qid, resolution FROM resolutions "
+            "WHERE platform = ? AND qid IN ({placeholders})",
+            (platform,),
+            qids,
+        )
+
+    def put_resolutions(self, platform, resolutions):
+        stored_at = time.time()
+        self._insert(
+            "INSERT OR REPLACE INTO resolutions (platform, qid, resolution, stored_at) "
+            "VALUES (?, ?, ?, ?)",
+            [(platform, q, json.dumps(r), stored_at) for q, r in resolutions.items()],
+        )
+
+    def get_all_resolutions(self, platform):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT qid, resolution FROM resolutions WHERE platform = ?", (platform,)
+            )
+            return {qid: json.loads(value) for qid, value in rows}
+
+    def get_resolutions_since(self, platform, since):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT qid, resolution FROM resolutions WHERE platform = ? AND stored_at >= ?",
+                (platform, since),
+            )
+            return {qid: json.loads(value) for qid, value in rows}
+
+    def get_questions(self, platform, uid):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT qids FROM questions WHERE platform = ? AND uid = ?", (platform, uid)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_questions(self, platform, uid, qids):
+        self._insert(
+            "INSERT OR REPLACE INTO questions VALUES (?, ?, ?)",
+            [(platform, uid, json.dumps(list(qids)))],
+        )
+
+
+class FirestoreBackend(CacheBackend):
+    """
+    Forecasts are stored one document per question, users_{platform}/{uid}/forecasts/{qid};
+    the user's question ids in users_{platform}/{uid}/meta/questions (the user
+    document itself may still hold the legacy map of the whole forecast history,
+    too big to read on every miss); resolutions in a single
+    questions_{platform}/resolutions map, every write of which is also logged as
+    a questions_{platform}/resolutions/updates document {"stored_at", "resolutions"}
+    for incremental reads. The client is built by `make_client` on first use.
+    """
+
+    def __init__(self, make_client):
+        self.make_client = make_client
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self.make_client()
+            return self._client
+
+    def _user_ref(self, platform, uid):
+        return self.client.collection(f"users_{platform}").document(uid)
+
+    def _forecast_refs(self, platform, uid, qids):
+        user = self._user_ref(platform, uid)
+        return [user.collection("forecasts").document(q) for q in qids]
+
+    def _resolutions_ref(self, platform):
+        return self.client.collection(f"questions_{platform}").document("resolutions")
+
+    def get_forecasts(self, platform, uid, qids):
+        if not qids:
+            return dict()
+        snapshots = self.client.get_all(self._forecast_refs(platform, uid, qids))
+        return {snapshot.id: snapshot.to_dict() for snapshot in snapshots if snapshot.exists}
+
+    def put_forecasts(self, platform, uid, records):
+        refs = self._forecast_refs(platform, uid, list(records))
+        for chunk in _chunks(zip(refs, records.values()), BATCH_SIZE):
+            batch = self.client.batch()
+            for reference, record in chunk:
+                batch.set(reference, record)
+            batch.commit()
+
+    def get_resolutions(self, platform, qids):
+        if not qids:
+            return dict()
+        db_resolutions = self.get_all_resolutions(platform)
+        return {q: db_resolutions[q] for q in qids if q in db_resolutions}
+
+    def get_all_resolutions(self, platform):
+        db_resolutions = self._resolutions_ref(platform).get().to_dict()
+        return dict() if db_resolutions is None else db_resolutions
+
+    def get_resolutions_since(self, platform, since):
+        updates = (
+            self._resolutions_ref(platform)
+            .collection("updates")
+            .where("stored_at", ">=", since)
+            .stream()
+        )
+        resolutions = dict()
+        for update in sorted((u.to_dict() for u in updates), key=lambda u: u["stored_at"]):
+            resolutions.update(update["resolutions"])
+        return resolutions
+
+    def put_resolutions(self, platform, resolutions):
+        if resolutions:
+            reference = self._resolutions_ref(platform)
+            batch = self.client.batch()
+            batch.set(reference, resolutions, merge=True)
+            batch.set(
+                reference.collection("updates").document(),
+                {"stored_at": time.time(), "resolutions": resolutions},
+            )
+            batch.commit()
+
+    def _questions_ref(self, platform, uid):
+        return self._user_ref(platform, uid).collection("meta").document("questions")
+
+    def get_questions(self, platform, uid):
+        questions = self._questions_ref(platform, uid).get().to_dict()
+        return None if questions is None else questions["qids"]
+
+    def put_questions(self, platform, uid, qids):
+        self._questions_ref(platform, uid).set({"qids": list(qids)})
+
+
+class CoalescingBackend(CacheBackend):
+    """
+    Write-behind in front of a slow `backend` (e.g. Firestore): writes are merged
+    into pending maps and flushed by a background thread `delay` seconds after
+    the first of them, as one `put_*` call (one batched commit) per user and
+    platform. Writes of concurrent sessions thus share commits, and the
+    resolutions document is updated once per flush instead of once per session.
+
+    Reads see pending writes. `flush()` writes everything pending immediately.
+    """
+
+    def __init__(self, backend, delay=1.0):
+        self.backend = backend
+        self.delay = delay
+        self._forecasts = collections.defaultdict(dict)  # {(platform, uid): {qid: record}}
+        self._resolutions = collections.defaultdict(dict)  # {platform: {qid: resolution}}
+        self._questions = dict()  # {(platform, uid): qids}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        self.stats = {"writes": 0, "flushes": 0}
+
+    def _schedule(self):
+        # with self._lock held
+        self.stats["writes"] += 1
+        if self._timer is None:
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                forecasts, self._forecasts = self._forecasts, collections.defaultdict(dict)
+                resolutions, self._resolutions = self._resolutions, collections.defaultdict(dict)
+                questions, self._questions = self._questions, dict()
+                self._timer = None
+
+            try:
+                for (platform, uid), records in forecasts.items():
+                    self.backend.put_forecasts(platform, uid, records)
+                for platform, platform_resolutions in resolutions.items():
+                    self.backend.put_resolutions(platform, platform_resolutions)
+                for (platform, uid), qids in questions.items():
+                    self.backend.put_questions(platform, uid, qids)
+            except Exception as e:
+                logging.error(f"CoalescingBackend.flush | {e!r}")
+
+            if forecasts or resolutions or questions:
+                self.stats["flushes"] += 1
+
+    def get_forecasts(self, platform, uid, qids):
+        with self._lock:
+            pending = self._forecasts.get((platform, uid), {})
+            found = {q: pending[q] for q in qids if q in pending}
+        missing = [q for q in qids if q not in found]
+        if missing:
+            found.update(self.backend.get_forecasts(platform, uid, missing))
+        return found
+
+    def put_forecasts(self, platform, uid, records):
+        with self._lock:
+            self._forecasts[(platform, uid)].update(records)
+            self._schedule()
+
+    def get_resolutions(self, platform, qids):
+        with self._lock:
+            pending = self._resolutions.get(platform, {})
+            found = {q: pending[q] for q in qids if q in pending}
+        missing = [q for q in qids if q not in found]
+        if missing:
+            found.update(self.backend.get_resolutions(platform, missing))
+        return found
+
+    def put_resolutions(self, platform, resolutions):
+        if not resolutions:
+            return
+        with self._lock:
+            self._resolutions[platform].update(resolutions)
+            self._schedule()
+
+    def get_all_resolutions(self, platform):
+        resolutions = self.backend.get_all_resolutions(platform)
+        with self._lock:
+            resolutions.update(self._resolutions.get(platform, {}))
+        return resolutions
+
+    def get_resolutions_since(self, platform, since):
+        resolutions = self.backend.get_resolutions_since(platform, since)
+        with self._lock:
+            resolutions.update(self._resolutions.get(platform, {}))
+        return resolutions
+
+    def get_questions(self, platform, uid):
+        with self._lock:
+            if (platform, uid) in self._questions:
+                return self._questions[(platform, uid)]
+        return self.backend.get_questions(platform, uid)
+
+    def put_questions(self, platform, uid, qids):
+        with self._lock:
+            self._questions[(platform, uid)] = list(qids)
+            self._schedule()
+
+
+class TieredBackend(CacheBackend):
+    """
+    Read-through over `tiers`, fastest first: whatever a tier misses is asked
+    from the next one, and entries found deeper are copied into the tiers above.
+    Writes go to every tier.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = tiers
+
+    def _read_through(self, get, put, qids):
+        found, missing, misses_by_tier = dict(), list(qids), []
+        for tier in self.tiers:
+            if not missing:
+                break
+            hits = get(tier, missing)
+            for upper_tier, upper_missing in misses_by_tier:
+                backfill = {q: hits[q] for q in upper_missing if q in hits}
+                if backfill:
+                    put(upper_tier, backfill)
+            found.update(hits)
+            misses_by_tier.append((tier, missing))
+            missing = [q for q in missing if q not in hits]
+        return found
+
+    def get_forecasts(self, platform, uid, qids):
+        return self._read_through(
+            lambda tier, qs: tier.get_forecasts(platform, uid, qs),
+            lambda tier, records: tier.put_forecasts(platform, uid, records),
+            qids,
+        )
+
+    def put_forecasts(self, platform, uid, records):
+        for tier in self.tiers:
+            tier.put_forecasts(platform, uid, records)
+
+    def get_resolutions(self, platform, qids):
+        return self._read_through(
+            lambda tier, qs: tier.get_resolutions(platform, qs),
+            lambda tier, resolutions: tier.put_resolutions(platform, resolutions),
+            qids,
+        )
+
+    def put_resolutions(self, platform, resolutions):
+        for tier in self.tiers:
+            tier.put_resolutions(platform, resolutions)
+
+    def _backfill_resolutions(self, platform, resolutions, found_by_tier):
+        # Bulk reads are kept by the caller (e.g. the ResolutionIndex), so they are
+        # copied only into the persistent upper tiers, and only what those miss.
+        for tier, found in zip(self.tiers[:-1], found_by_tier):
+            if tier.in_memory:
+                continue
+            missing = {q: r for q, r in resolutions.items() if q not in found}
+            if missing:
+                tier.put_resolutions(platform, missing)
+
+    def get_all_resolutions(self, platform):
+        """
+        The union of all tiers; what a persistent upper tier misses is copied into it.
+        """
+        found_by_tier = [tier.get_all_resolutions(platform) for tier in self.tiers]
+        resolutions = dict()
+        for found in reversed(found_by_tier):
+            resolutions.update(found)
+        self._backfill_resolutions(platform, resolutions, found_by_tier)
+        return resolutions
+
+    def get_resolutions_since(self, platform, since):
+        resolutions = dict()
+        for tier in reversed(self.tiers):
+            resolutions.update(tier.get_resolutions_since(platform, since))
+        if resolutions:
+            found_by_tier = [
+                dict() if tier.in_memory else tier.get_resolutions(platform, list(resolutions))
+                for tier in self.tiers[:-1]
+            ]
+            self._backfill_resolutions(platform, resolutions, found_by_tier)
+        return resolutions
+
+    def get_questions(self, platform, uid):
+        for depth, tier in enumerate(self.tiers):
+            qids = tier.get_questions(platform, uid)
+            if qids is not None:
+                for upper_tier in self.tiers[:depth]:
+                    upper_tier.put_questions(platform, uid, qids)
+                return qids
+        return None
+
+    def put_questions(self, platform, uid, qids):
+        for tier in self.tiers:
+            tier.put_questions(platform, uid, qids)
@@ -1,16 +1,15 @@
 import logging
 import sys
 import numpy as np
+from statistics import NormalDist
 
+import tracing
 
-logging.basicConfig(stream=sys.stdout)
 
+logging.basicConfig(stream=sys.stdout)
 
-# This function is a sklearn.calibration.calibration_curve modification
-def calibration_curve(y_true, y_prob, *, n_bins=5, strategy="uniform"):
-    y_true = np.array(y_true)
-    y_prob = np.array(y_prob)
 
+def bin_edges(y_prob, n_bins, strategy="uniform"):
     if strategy == "quantile":  # Determine bin edges by distribution of data
         quantiles = np.linspace(0, 1, n_bins + 1)
         bins = np.percentile(y_prob, quantiles * 100)
@@ -25,6 +24,21 @@ def calibration_curve(y_true, y_prob, *, n_bins=5, strategy="uniform"):
             "must be either 'quantile' or 'uniform'."
         )
 
+    return bins
+
+
+# This function is a sklearn.calibration.calibration_curve modification
+@tracing.traced("calibration.curve")
+def calibration_curve(y_true, y_prob, *, n_bins=5, strategy="uniform", sample_weight=None):
+    """
+    With `sample_weight` the returned counts are the sums of the weights in
+    each bin; quantile bin edges stay unweighted.
+    """
+    y_true = np.array(y_true)
+    y_prob = np.array(y_prob)
+
+    bins = bin_edges(y_prob, n_bins, strategy)
+
     try:
         binids = np.digitize(y_prob, bins) - 1
     
@@ -39,9 +53,15 @@ def calibration_curve(y_true, y_prob, *, n_bins=5, strategy="uniform"):
         raise e
 
 
-    bin_sums = np.bincount(binids, weights=y_prob, minlength=len(bins))
-    bin_true = np.bincount(binids, weights=y_true, minlength=len(bins))
-    bin_total = np.bincount(binids, minlength=len(bins))
+    if sample_weight is None:
+        bin_sums = np.bincount(binids, weights=y_prob, minlength=len(bins))
+        bin_true = np.bincount(binids, weights=y_true, minlength=len(bins))
+        bin_total = np.bincount(binids, minlength=len(bins))
+    else:
+        sample_weight = np.asarray(sample_weight, dtype=float)
+        bin_sums = np.bincount(binids, weights=y_prob * sample_weight, minlength=len(bins))
+        bin_true = np.bincount(binids, weights=y_true * sample_weight, minlength=len(bins))
+        bin_total = np.bincount(binids, weights=sample_weight, minlength=len(bins))
 
     nonzero = bin_total != 0
     prob_true = bin_true[nonzero] / bin_total[nonzero]
@@ -50,6 +70,357 @@ def calibration_curve(y_true, y_prob, *, n_bins=5, strategy="uniform"):
     return prob_true, prob_pred, bin_total[nonzero]
 
 
+def decay_weights(timestamps, half_life, now=None):
+    """
+    Exponentially decaying weights: a forecast made `half_life` seconds before
+    `now` (by default the latest timestamp) counts half as much as one made at
+    `now`.
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    now = np.nanmax(timestamps) if now is None else now
+    return 0.5 ** ((now - timestamps) / half_life)
+
+
+def wilson_interval(successes, totals, level=0.6827):
+    """
+    Wilson score interval for a binomial proportion; unlike the normal
+    approximation it stays inside [0, 1] and does not collapse at 0 or 1.
+    """
+    successes = np.asarray(successes, dtype=float)
+    totals = np.asarray(totals, dtype=float)
+
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    p = successes / totals
+    center = (p + z ** 2 / (2 * totals)) / (1 + z ** 2 / totals)
+    half_width = (
+        z / (1 + z ** 2 / totals) * np.sqrt(p * (1 - p) / totals + z ** 2 / (4 * totals ** 2))
+    )
+    return np.clip(center - half_width, 0, 1), np.clip(center + half_width, 0, 1)
+
+
+@tracing.traced("calibration.bootstrap")
+def bootstrap_interval(
+    y_true,
+    y_prob,
+    groups,
+    bins,
+    *,
+    n_boot=1000,
+    level=0.6827,
+    seed=0,
+    chunk_size=250,
+    sample_weight=None,
+):
+    """
+    Percentile bootstrap interval of the fraction of positives in each bin.
+
+    Whole groups (questions) are resampled, since forecasts on one question are
+    correlated. Per-(group, bin) totals are computed once; then every resample is
+    a row of group multiplicities, obtained with one `bincount` over the flattened
+    (n_boot, n_groups) index matrix, and its per-bin totals are a matrix product.
+    `chunk_size` resamples are materialised at a time to bound memory.
+    """
+    y_true = np.asarray(y_true, dtype=float)
+    binids = np.digitize(y_prob, bins) - 1
+    n_bins = len(bins)
+    weights = None if sample_weight is None else np.asarray(sample_weight, dtype=float)
+
+    _, groups = np.unique(groups, return_inverse=True)
+    n_groups = groups.max() + 1 if len(groups) else 0
+
+    cells = groups * n_bins + binids
+    group_total = np.bincount(cells, weights=weights, minlength=n_groups * n_bins).reshape(
+        n_groups, n_bins
+    )
+    group_total = group_total.astype(float)  # float matrix products go through BLAS
+    group_true = np.bincount(
+        cells,
+        weights=y_true if weights is None else y_true * weights,
+        minlength=n_groups * n_bins,
+    ).reshape(n_groups, n_bins)
+
+    rng = np.random.default_rng(seed)
+    fractions = []
+    for start in range(0, n_boot, chunk_size):
+        size = min(chunk_size, n_boot - start)
+        resampled = rng.integers(0, n_groups, size=(size, n_groups))
+        resampled += np.arange(size)[:, None] * n_groups
+        multiplicity = np.bincount(
+            resampled.ravel(), minlength=size * n_groups
+        ).reshape(size, n_groups).astype(float)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fractions.append((multiplicity @ group_true) / (multiplicity @ group_total))
+
+    fractions = np.concatenate(fractions)
+    nonzero = group_total.sum(axis=0) != 0
+    lower, upper = np.nanpercentile(
+        fractions[:, nonzero], [50 - 50 * level, 50 + 50 * level], axis=0
+    )
+    return lower, upper
+
+
 def overconfidence(y_true, y_pred):
     x = y_pred * y_true + (1 - y_pred) * (1 - y_true)
     return np.mean((x - 1) * (x - 0.5)) / np.mean((x - 0.5) * (x - 0.5))
+
+
+# Categorical forecasts are stored ragged: forecast f has the options
+# probability[offsets[f]:offsets[f + 1]] and the one-hot outcome alongside, as
+# in `forecast_store.ForecastStore`. The functions below reduce over every
+# forecast at once with `ufunc.reduceat`.
+
+
+def _segment_starts(offsets):
+    # Empty forecasts own no datapoints, so the segments between the starts of
+    # the non-empty ones are exactly those forecasts, as `reduceat` needs.
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sizes = np.diff(offsets)
+    return offsets[:-1][sizes > 0], sizes[sizes > 0]
+
+
+def top_label(probability, outcome, offsets):
+    """
+    `(y_true, y_prob, option)` of the most likely option of every (non-empty)
+    forecast: whether it happened, its probability and its position in the
+    forecast (the first one on ties).
+    """
+    probability = np.asarray(probability, dtype=float)
+    outcome = np.asarray(outcome, dtype=float)
+    starts, sizes = _segment_starts(offsets)
+    if len(starts) == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+    y_prob = np.maximum.reduceat(probability, starts)
+
+    positions = np.arange(len(probability))
+    is_max = probability == np.repeat(y_prob, sizes)
+    argmax = np.minimum.reduceat(np.where(is_max, positions, len(probability)), starts)
+
+    return outcome[argmax], y_prob, argmax - starts
+
+
+def classwise_calibration_curves(
+    probability, outcome, option_index, *, n_bins=5, strategy="uniform"
+):
+    """
+    `{option: calibration_curve(...)}` over the datapoints of every option
+    position, e.g. the first options of all the forecasts.
+    """
+    option_index = np.asarray(option_index)
+    probability = np.asarray(probability, dtype=float)
+    outcome = np.asarray(outcome, dtype=float)
+
+    order = np.argsort(option_index, kind="stable")
+    options, starts = np.unique(option_index[order], return_index=True)
+    groups = np.split(order, starts[1:])
+
+    return {
+        int(option): calibration_curve(
+            outcome[group], probability[group], n_bins=n_bins, strategy=strategy
+        )
+        for option, group in zip(options, groups)
+    }
+
+
+def multiclass_brier_scores(probability, outcome, offsets):
+    """
+    Brier score of every (non-empty) forecast: the sum over its options of the
+    squared differences between the probability and the outcome.
+    """
+    starts, _ = _segment_starts(offsets)
+    if len(starts) == 0:
+        return np.zeros(0)
+    squared = (np.asarray(probability, dtype=float) - np.asarray(outcome, dtype=float)) ** 2
+    return np.add.reduceat(squared, starts)
+
+
+def multiclass_log_scores(probability, outcome, offsets, eps=1e-3):
+    """
+    Logarithmic score of every (non-empty) forecast, `-log(p)` of the option
+    which happened; probabilities are clipped to [eps, 1] first.
+    """
+    starts, _ = _segment_starts(offsets)
+    if len(starts) == 0:
+        return np.zeros(0)
+    log_probability = np.log(np.clip(np.asarray(probability, dtype=float), eps, 1))
+    return -np.add.reduceat(np.asarray(outcome, dtype=float) * log_probability, starts)
+
+
+class CalibrationEngine:
+    """
+    Answers `calibration_curve` queries for any number of bins and either strategy
+    after sorting `y_prob` once: bin edges are located with `searchsorted` and the
+    per-bin sums are differences of prefix sums, so a query costs O(n_bins log n)
+    instead of O(n).
+    """
+
+    @tracing.traced("calibration.engine_sort")
+    def __init__(self, y_true, y_prob, sample_weight=None):
+        y_true = np.asarray(y_true, dtype=float)
+        y_prob = np.asarray(y_prob, dtype=float)
+
+        order = np.argsort(y_prob, kind="stable")
+        self.y_prob = y_prob[order]
+        self._quantile_edges = dict()  # {n_bins: bins}
+
+        # Without weights the bin totals are differences of positions.
+        self.cum_weight = None
+        if sample_weight is None:
+            self.cum_prob = np.concatenate([[0.0], np.cumsum(self.y_prob)])
+            self.cum_true = np.concatenate([[0.0], np.cumsum(y_true[order])])
+        else:
+            weight = np.asarray(sample_weight, dtype=float)[order]
+            self.cum_prob = np.concatenate([[0.0], np.cumsum(self.y_prob * weight)])
+            self.cum_true = np.concatenate([[0.0], np.cumsum(y_true[order] * weight)])
+            self.cum_weight = np.concatenate([[0.0], np.cumsum(weight)])
+
+    def __len__(self):
+        return len(self.y_prob)
+
+    def bin_edges(self, n_bins, strategy="uniform"):
+        if strategy != "quantile":
+            return bin_edges(self.y_prob, n_bins, strategy)
+
+        # The edges of `bin_edges` itself: whole-percent forecasts tie a lot, and
+        # an edge 1 ulp off a tied probability would move all of its datapoints
+        # to another bin. np.percentile is cheap on the already sorted data.
+        if n_bins not in self._quantile_edges:
+            self._quantile_edges[n_bins] = bin_edges(self.y_prob, n_bins, strategy)
+        return self._quantile_edges[n_bins]
+
+    def _curve_from_boundaries(self, boundaries):
+        # Bin i holds y_prob[boundaries[i]:boundaries[i + 1]], the last one catches
+        # values beyond the last edge (as np.digitize does).
+        boundaries = np.append(boundaries, len(self.y_prob))
+
+        bin_sums = np.diff(self.cum_prob[boundaries])
+        bin_true = np.diff(self.cum_true[boundaries])
+        if self.cum_weight is None:
+            bin_total = np.diff(boundaries)
+        else:
+            bin_total = np.diff(self.cum_weight[boundaries])
+
+        nonzero = bin_total != 0
+        prob_true = bin_true[nonzero] / bin_total[nonzero]
+        prob_pred = bin_sums[nonzero] / bin_total[nonzero]
+
+        return prob_true, prob_pred, bin_total[nonzero]
+
+    @tracing.traced("calibration.engine_curve")
+    def curve(self, n_bins=5, strategy="uniform"):
+        bins = self.bin_edges(n_bins, strategy)
+        return self._curve_from_boundaries(np.searchsorted(self.y_prob, bins))
+
+    @tracing.traced("calibration.engine_curves")
+    def curves(self, n_bins_list, strategy="uniform"):
+        """
+        Computes the curves for a batch of bin counts with a single `searchsorted`.
+        """
+        edges = [self.bin_edges(n_bins, strategy) for n_bins in n_bins_list]
+        boundaries = np.searchsorted(self.y_prob, np.concatenate(edges))
+        splits = np.cumsum([len(bins) for bins in edges])[:-1]
+        return [self._curve_from_boundaries(b) for b in np.split(boundaries, splits)]
+
+
+class CalibrationAccumulator:
+    """
+    Uniform-bin calibration curve of a growing dataset: `add` updates the per-bin
+    sums with the new datapoints only, so redrawing while data loads costs
+    O(new datapoints + n_bins). Quacks like `CalibrationEngine` for its own
+    `n_bins` and the "uniform" strategy.
+    """
+
+    def __init__(self, n_bins=21):
+        self.n_bins = n_bins
+        self.bins = bin_edges(None, n_bins, "uniform")
+        self.bin_sums = np.zeros(len(self.bins))
+        self.bin_true = np.zeros(len(self.bins))
+        self.bin_total = np.zeros(len(self.bins), dtype=np.int64)
+
+    def __len__(self):
+        return int(self.bin_total.sum())
+
+    def add(self, y_true, y_prob):
+        binids = np.digitize(y_prob, self.bins) - 1
+        self.bin_sums += np.bincount(binids, weights=y_prob, minlength=len(self.bins))
+        self.bin_true += np.bincount(binids, weights=y_true, minlength=len(self.bins))
+        self.bin_total += np.bincount(binids, minlength=len(self.bins))
+
+    def _check(self, n_bins, strategy):
+        if n_bins != self.n_bins or strategy != "uniform":
+            raise ValueError(
+                f"CalibrationAccumulator only knows {self.n_bins} uniform bins, "
+                f"got n_bins={n_bins}, strategy={strategy}"
+            )
+
+    def bin_edges(self, n_bins, strategy="uniform"):
+        self._check(n_bins, strategy)
+        return self.bins
+
+    def curve(self, n_bins=None, strategy="uniform"):
+        self._check(self.n_bins if n_bins is None else n_bins, strategy)
+
+        nonzero = self.bin_total != 0
+        prob_true = self.bin_true[nonzero] / self.bin_total[nonzero]
+        prob_pred = self.bin_sums[nonzero] / self.bin_total[nonzero]
+
+        return prob_true, prob_pred, self.bin_total[nonzero]
+
+
+@tracing.traced("calibration.rolling")
+def rolling_calibration(
+    y_true, y_prob, timestamps, window, step=None, n_bins=10, sample_weight=None
+):
+    """
+    Uniform-bin calibration curves over the time windows [start, start + window)
+    with a start every `step` seconds (by default `window / 4`), from the
+    earliest timestamp until a window covers the latest one. Datapoints without
+    a timestamp (NaN) are left out.
+
+    Datapoints are sorted once by (bin, timestamp), so the datapoints of a bin in
+    a window are a contiguous run; its sums are differences of prefix sums at
+    positions found by one `searchsorted` for all the windows and bins.
+
+    Returns `starts` and (n_windows, n_bins) arrays `prob_true`, `prob_pred`
+    (NaN for empty bins) and `counts`.
+    """
+    y_true = np.asarray(y_true, dtype=float)
+    y_prob = np.asarray(y_prob, dtype=float)
+    timestamps = np.asarray(timestamps, dtype=float)
+    weight = np.ones(len(y_prob)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+    step = window / 4 if step is None else step
+
+    known = ~np.isnan(timestamps)
+    y_true, y_prob, timestamps, weight = y_true[known], y_prob[known], timestamps[known], weight[known]
+    if len(timestamps) == 0:
+        empty = np.zeros((0, n_bins))
+        return np.zeros(0), empty, empty, empty
+
+    first, last = timestamps.min(), timestamps.max()
+    span = last - first + 1  # keys of different bins never overlap
+    binids = np.digitize(y_prob, bin_edges(None, n_bins, "uniform")) - 1
+
+    keys = binids * span + (timestamps - first)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    cum_weight = np.concatenate([[0.0], np.cumsum(weight[order])])
+    cum_true = np.concatenate([[0.0], np.cumsum((y_true * weight)[order])])
+    cum_prob = np.concatenate([[0.0], np.cumsum((y_prob * weight)[order])])
+
+    if last - first < window:
+        n_windows = 1
+    else:
+        n_windows = int(np.floor((last - first - window) / step)) + 2
+    offsets = step * np.arange(n_windows)
+
+    bin_keys = np.arange(n_bins)[None, :] * span
+    lo = np.searchsorted(keys, bin_keys + offsets[:, None])
+    hi = np.searchsorted(keys, bin_keys + np.minimum(offsets + window, span - 0.5)[:, None])
+
+    counts = cum_weight[hi] - cum_weight[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        prob_true = (cum_true[hi] - cum_true[lo]) / counts
+        prob_pred = (cum_prob[hi] - cum_prob[lo]) / counts
+
+    return first + offsets, prob_true, prob_pred, counts
@@ -0,0 +1,87 @@
+"""
+Arrays and figures derived from a `ForecastStore`, memoized on the content hash
+of the store (`ForecastStore.fingerprint`) and the parameters, so that
+Streamlit reruns caused by widgets do not recompute them.
+
+`view` selects the datapoints (see `ForecastStore.datapoints`), `start` and
+`end` restrict them to forecasts made in [start, end) and `half_life` weights
+them by recency (all in epoch seconds, None to disable). The results are shared between callers and must not be mutated.
+"""
+from calibration import CalibrationEngine, decay_weights, rolling_calibration
+from memo import memoize
+from plotting import (
+    clip_for_odds,
+    plotly_calibration,
+    plotly_calibration_odds,
+    plotly_calibration_over_time,
+)
+
+MAX_DATASETS = 8
+MAX_FIGURES = 64
+
+
+def _data_key(store, view="drop_last", start=None, end=None, half_life=None):
+    return store.fingerprint, view, start, end, half_life
+
+
+@memoize(key=_data_key, maxsize=MAX_DATASETS)
+def binary_data(store, view="drop_last", start=None, end=None, half_life=None):
+    """
+    `(y_true, y_pred, groups, sample_weight, engine, odds_engine)` of
+    `store.datapoints(view)`; `sample_weight` is None without `half_life`.
+    """
+    if start is None and end is None and half_life is None:
+        timestamp = None
+        y_true, y_pred, groups, _ = store.datapoints(view)
+    else:
+        timestamp, y_true, y_pred, groups = store.window(start, end, view)
+
+    sample_weight = None if half_life is None else decay_weights(timestamp, half_life)
+
+    engine = CalibrationEngine(y_true, y_pred, sample_weight)
+    odds_engine = CalibrationEngine(*clip_for_odds(y_true, y_pred), sample_weight)
+    return y_true, y_pred, groups, sample_weight, engine, odds_engine
+
+
+def _figure_key(
+    store, n_bins, strategy, errors, view="drop_last", start=None, end=None, half_life=None
+):
+    return store.fingerprint, n_bins, strategy, errors, view, start, end, half_life
+
+
+@memoize(key=_figure_key, maxsize=MAX_FIGURES)
+def calibration_figure(
+    store, n_bins, strategy, errors, view="drop_last", start=None, end=None, half_life=None
+):
+    y_true, y_pred, groups, sample_weight, engine, _ = binary_data(
+        store, view, start, end, half_life
+    )
+    return plotly_calibration(
+        y_true, y_pred, n_bins=n_bins, strategy=strategy, engine=engine,
+        errors=errors, groups=groups, sample_weight=sample_weight,
+    )
+
+
+@memoize(key=_figure_key, maxsize=MAX_FIGURES)
+def calibration_odds_figure(
+    store, n_bins, strategy, errors, view="drop_last", start=None, end=None, half_life=None
+):
+    y_true, y_pred, groups, sample_weight, _, odds_engine = binary_data(
+        store, view, start, end, half_life
+    )
+    return plotly_calibration_odds(
+        y_true, y_pred, n_bins=n_bins, strategy=strategy, engine=odds_engine,
+        errors=errors, groups=groups, sample_weight=sample_weight,
+    )
+
+
+@memoize(
+    key=lambda store, window, n_bins=10, view="drop_last": (store.fingerprint, window, n_bins, view),
+    maxsize=MAX_FIGURES,
+)
+def calibration_over_time_figure(store, window, n_bins=10, view="drop_last"):
+    timestamp, y_true, y_pred, _ = store.binary_by_time(view)
+    starts, prob_true, prob_pred, counts = rolling_calibration(
+        y_true, y_pred, timestamp, window, n_bins=n_bins
+    )
+    return plotly_calibration_over_time(starts, window, prob_true, prob_pred, counts)
@@ -1,50 +1,251 @@
+import atexit
 import json
+import logging
+import threading
 
 import streamlit as st
-from google.cloud import firestore
-from google.oauth2 import service_account
 
-from gjo_requests import request_forecasts, request_resolutions
+import tracing
 
-firestore_info = json.loads(st.secrets["firestore_info"])
-credentials = service_account.Credentials.from_service_account_info(firestore_info)
-db = firestore.Client(credentials=credentials, project="gjo-calibration")
+from cache_backends import (
+    CoalescingBackend,
+    FirestoreBackend,
+    MemoryLRUBackend,
+    SQLiteBackend,
+    TieredBackend,
+)
+from gjo_requests import configure_parsing, request_forecasts, request_resolutions, stream_user_data
+from memo import TTLCache, memoize
+from resolution_index import ResolutionIndex
+from scheduler import configure_http_cache
 
+DEFAULT_SQLITE_PATH = "gjo_cache.sqlite"
+DEFAULT_HTTP_CACHE_PATH = "gjo_http_cache.sqlite"
 
+
+def _secret(name):
+    try:
+        return st.secrets[name]
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+def _make_firestore_client():
+    from google.cloud import firestore
+    from google.oauth2 import service_account
+
+    firestore_info = json.loads(_secret("firestore_info"))
+    credentials = service_account.Credentials.from_service_account_info(firestore_info)
+    return firestore.Client(credentials=credentials, project="gjo-calibration")
+
+
+def _make_backend():
+    """
+    Memory, then a local SQLite file, then Firestore (if there are credentials
+    for it) with coalesced writes; nothing is opened until the first read.
+    """
+    tiers = [MemoryLRUBackend(), SQLiteBackend(_secret("sqlite_path") or DEFAULT_SQLITE_PATH)]
+
+    if _secret("firestore_info") is not None:
+        firestore = CoalescingBackend(FirestoreBackend(_make_firestore_client))
+        atexit.register(firestore.flush)
+        tiers.append(firestore)
+    else:
+        logging.warning("No firestore_info secret: caching locally only.")
+
+    return TieredBackend(tiers)
+
+
+_backend, _resolution_index = None, None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    The process-wide cache backend, made on first use (reading the secrets).
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _make_backend()
+        return _backend
+
+
+def get_resolution_index():
+    global _resolution_index
+    backend = get_backend()
+    with _backend_lock:
+        if _resolution_index is None:
+            _resolution_index = ResolutionIndex(backend)
+        return _resolution_index
+
+
+_scraping_configured = False
+
+
+def configure_scraping():
+    """
+    Applies the scraping secrets once per process, before any session is opened:
+    "parse_workers" parses pages in that many processes (inline by default) and
+    scraped pages are revalidated against the HTTP cache at "http_cache_path".
+    """
+    global _scraping_configured
+    with _backend_lock:
+        if not _scraping_configured:
+            configure_parsing(int(_secret("parse_workers") or 0))
+            configure_http_cache(_secret("http_cache_path") or DEFAULT_HTTP_CACHE_PATH)
+            _scraping_configured = True
+
+
+user_data_cache = TTLCache()  # {(platform_url, uid): [(qid, forecasts, resolution), ...]}
+store_cache = TTLCache(maxsize=64)  # {(platform_url, uid): ForecastStore built by the app}
+
+
+def _platform(platform_url):
+    return "gjo" if platform_url == "https://www.gjopen.com" else "cset"
+
+
+# A forecast record keeps the last prediction_sets page scraped; an incomplete
+# record is resumed from that page instead of being scraped again.
+def _forecast_record(forecasts, complete=True):
+    return {
+        "forecasts": forecasts,
+        "last_page": max((f.get("page", 1) for f in forecasts), default=0),
+        "complete": complete,
+    }
+
+
+@memoize(
+    key=lambda uid, questions, platform_url, headers, cookies: (
+        platform_url, uid, frozenset(questions)
+    )
+)
 def get_forecasts(uid, questions, platform_url, headers, cookies):
-    platform = "gjo" if platform_url == "https://www.gjopen.com" else "cset"
+    configure_scraping()
+    platform = _platform(platform_url)
 
-    db_forecasts = db.collection(f"users_{platform}").document(uid).get().to_dict()
-    db_forecasts = dict() if db_forecasts is None else db_forecasts
+    records = get_backend().get_forecasts(platform, uid, list(set(questions)))
+    db_forecasts = {q: r["forecasts"] for q, r in records.items() if r["complete"]}
+    partial_records = {q: r for q, r in records.items() if not r["complete"]}
 
     missing_forecasts_qs = list(set(questions) - set(db_forecasts))
     missing_forecasts = request_forecasts(
-        uid, missing_forecasts_qs, platform_url, headers, cookies
+        uid, missing_forecasts_qs, platform_url, headers, cookies, partial_records
     )
 
     if missing_forecasts:
-        if not db_forecasts:
-            db.collection(f"users_{platform}").add({}, uid)
-        db.collection(f"users_{platform}").document(uid).update(missing_forecasts)
+        get_backend().put_forecasts(
+            platform, uid, {q: _forecast_record(f) for q, f in missing_forecasts.items()}
+        )
 
-    return {key: value for key, value in {**db_forecasts, **missing_forecasts}.items() if key in questions}
+    return {**db_forecasts, **missing_forecasts}
 
 
+@memoize(
+    key=lambda questions, platform_url, headers, cookies: (
+        platform_url, frozenset(questions)
+    )
+)
 def get_resolutions(questions, platform_url, headers, cookies):
-    platform = "gjo" if platform_url == "https://www.gjopen.com" else "cset"
+    configure_scraping()
+    platform = _platform(platform_url)
 
-    db_resolutions = db.collection(f"questions_{platform}").document("resolutions").get().to_dict()
-    db_resolutions = dict() if db_resolutions is None else db_resolutions
-    relevant_resolutions = {
-        key: value for key, value in db_resolutions.items() if key in set(questions)
-    }
+    relevant_resolutions = get_resolution_index().get(platform, set(questions))
 
     missing_resolutions_qs = list(set(questions) - set(relevant_resolutions))
     missing_resolutions = request_resolutions(
         missing_resolutions_qs, platform_url, headers, cookies
     )
 
-    if missing_resolutions:
-        db.collection(f"questions_{platform}").document("resolutions").update(missing_resolutions)
+    get_resolution_index().put(platform, missing_resolutions)
 
     return {**relevant_resolutions, **missing_resolutions}
+
+
+def iter_user_data(uid, platform_url, headers, cookies, progress=None):
+    """
+    Yields (qid, forecasts, resolution) for every resolved question of the user,
+    scraping only what is not cached yet. The cache is read in batches as the
+    question ids arrive; scraped data is written back once the stream is
+    exhausted (or abandoned).
+
+    The question ids of a fully consumed stream are stored, so that the next
+    visit of the user only lists the scores pages resolved since. The stream
+    itself, unless some of its questions failed, is kept in `user_data_cache`
+    and replayed on the following calls for the same user. `progress` is filled
+    as described in `gjo_requests.async_stream_user_data`.
+    """
+    with tracing.span("cache.user_data"):
+        cached = user_data_cache.get((platform_url, uid))
+        tracing.annotate(cache_hit=cached is not None)
+    if cached is not None:
+        if progress is not None:
+            progress.update(found=len(cached), done=len(cached), failed=0, listed=True)
+        yield from cached
+        return
+
+    configure_scraping()
+    platform = _platform(platform_url)
+    progress = dict() if progress is None else progress
+
+    with tracing.span("cache.get_questions"):
+        known_qs = get_backend().get_questions(platform, uid)
+        tracing.annotate(hits=0 if known_qs is None else len(known_qs))
+
+    listed_qs, complete_forecasts_qs, known_resolutions_qs = [], set(), set()
+
+    def lookup_forecasts(qs):
+        listed_qs.extend(qs)
+        with tracing.span("cache.get_forecasts", lookups=len(qs)):
+            records = get_backend().get_forecasts(platform, uid, qs)
+            tracing.annotate(hits=len(records))
+        complete_forecasts_qs.update(q for q, r in records.items() if r["complete"])
+        return records
+
+    def lookup_resolutions(qs):
+        with tracing.span("cache.get_resolutions", lookups=len(qs)):
+            found = get_resolution_index().get(platform, qs)
+            tracing.annotate(hits=len(found))
+        known_resolutions_qs.update(found)
+        return found
+
+    def store_incomplete(q, forecasts):
+        with tracing.span("cache.put_incomplete", forecasts=len(forecasts)):
+            get_backend().put_forecasts(
+                platform, uid, {q: _forecast_record(forecasts, complete=False)}
+            )
+
+    new_records, missing_resolutions = dict(), dict()
+    user_data = []
+
+    try:
+        for q, forecasts, resolution in stream_user_data(
+            uid,
+            platform_url,
+            headers,
+            cookies,
+            lookup_forecasts=lookup_forecasts,
+            lookup_resolutions=lookup_resolutions,
+            store_incomplete=store_incomplete,
+            known=known_qs,
+            progress=progress,
+        ):
+            if q not in complete_forecasts_qs:
+                new_records[q] = _forecast_record(forecasts)
+            if q not in known_resolutions_qs:
+                missing_resolutions[q] = resolution
+
+            user_data.append((q, forecasts, resolution))
+            yield q, forecasts, resolution
+
+        get_backend().put_questions(platform, uid, listed_qs)
+        # questions which failed are retried on the next call
+        if not progress["failed"]:
+            user_data_cache.put((platform_url, uid), user_data)
+    finally:
+        with tracing.span(
+            "cache.put", forecasts=len(new_records), resolutions=len(missing_resolutions)
+        ):
+            if new_records:
+                get_backend().put_forecasts(platform, uid, new_records)
+            get_resolution_index().put(platform, missing_resolutions)
@@ -0,0 +1,270 @@
+import hashlib
+import logging
+
+import numpy as np
+
+from calibration import multiclass_brier_scores, multiclass_log_scores, top_label
+
+
+def parse_timestamps(timestamps):
+    """
+    Parses scraped timestamps into seconds since the epoch (NaN if unparsable).
+    """
+    if len(timestamps) == 0:
+        return np.zeros(0)
+
+    import pandas as pd
+
+    parsed = pd.to_datetime(pd.Series(timestamps), utc=True, errors="coerce")
+    return ((parsed - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=float)
+
+
+class ForecastStore:
+    """
+    Forecasts of one user in a columnar layout.
+
+    Every datapoint is one option of one forecast; its columns are
+    `question_index`, `forecast_index`, `option_index`, `probability` and
+    `outcome`. Forecast `f` owns datapoints
+    `forecast_offsets[f]:forecast_offsets[f + 1]` and question `q` owns forecasts
+    `question_offsets[q]:question_offsets[q + 1]`. `timestamp` holds the epoch
+    time of each forecast and `qids` the question id of each question.
+    """
+
+    def __init__(self, qids, question_offsets, forecast_offsets, probability, outcome, timestamp):
+        self.qids = list(qids)
+        self.question_offsets = np.asarray(question_offsets, dtype=np.int64)
+        self.forecast_offsets = np.asarray(forecast_offsets, dtype=np.int64)
+        self.probability = np.asarray(probability, dtype=float)
+        self.outcome = np.asarray(outcome, dtype=float)
+        self.timestamp = np.asarray(timestamp, dtype=float)
+
+        forecasts_per_question = np.diff(self.question_offsets)
+        options_per_forecast = np.diff(self.forecast_offsets)
+
+        self.forecast_question = np.repeat(
+            np.arange(len(self.qids), dtype=np.int32), forecasts_per_question
+        )
+        self.forecast_index = np.repeat(
+            np.arange(len(options_per_forecast), dtype=np.int32), options_per_forecast
+        )
+        self.question_index = self.forecast_question[self.forecast_index]
+        self.option_index = (
+            np.arange(len(self.probability)) - np.repeat(self.forecast_offsets[:-1], options_per_forecast)
+        ).astype(np.int32)
+
+        self._binary_views = dict()
+        self._time_views = dict()
+        self._fingerprint = None
+
+    @property
+    def n_questions(self):
+        return len(self.qids)
+
+    @property
+    def n_forecasts(self):
+        return len(self.forecast_offsets) - 1
+
+    def __len__(self):
+        return len(self.probability)
+
+    @property
+    def fingerprint(self):
+        """
+        A hash of the content of the store, e.g. to key caches of derived data.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update("\0".join(map(str, self.qids)).encode())
+            for column in (
+                self.question_offsets,
+                self.forecast_offsets,
+                self.probability,
+                self.outcome,
+                self.timestamp,
+            ):
+                digest.update(column.tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    @classmethod
+    def from_stream(cls, items):
+        """
+        Builds the store from (qid, forecasts, resolution) triples, as yielded by
+        `gjo_requests.stream_user_data` / `firebase_requests.iter_user_data`.
+        """
+        builder = ForecastStoreBuilder()
+        for qid, forecasts, resolution in items:
+            builder.add_question(qid, forecasts, resolution)
+        return builder.build()
+
+    @classmethod
+    def from_dicts(cls, questions, forecasts, resolutions):
+        """
+        Builds the store from `{qid: [{"y_pred": ..., "timestamp": ...}, ...]}`
+        and `{qid: {"y_true": ...}}` dicts.
+        """
+        return cls.from_stream((q, forecasts[q], resolutions[q]) for q in questions)
+
+    def _keep_not_last(self):
+        keep = np.ones(len(self), dtype=bool)
+        keep[self.forecast_offsets[1:][np.diff(self.forecast_offsets) > 0] - 1] = False
+        return keep
+
+    def datapoints(self, view="drop_last"):
+        """
+        Returns `(y_true, y_pred, groups, forecasts)`: binary datapoints, the
+        question index and the forecast index of each. `view` is one of
+
+        - "all": every option of every forecast is a datapoint;
+        - "drop_last": as "all" without the last option of every forecast (it is
+          determined by the others);
+        - "top_label": one datapoint per forecast, its most likely option.
+
+        The arrays are computed once and shared read-only between calls; for
+        "all" they are the columns themselves.
+        """
+        if view not in self._binary_views:
+            if view == "all":
+                views = self.outcome, self.probability, self.question_index, self.forecast_index
+            elif view == "drop_last":
+                keep = self._keep_not_last()
+                views = (
+                    self.outcome[keep],
+                    self.probability[keep],
+                    self.question_index[keep],
+                    self.forecast_index[keep],
+                )
+            elif view == "top_label":
+                y_true, y_pred, _ = top_label(self.probability, self.outcome, self.forecast_offsets)
+                forecasts = np.flatnonzero(np.diff(self.forecast_offsets) > 0).astype(np.int32)
+                views = y_true, y_pred, self.forecast_question[forecasts], forecasts
+            else:
+                raise ValueError(
+                    "Invalid entry to 'view' input. View "
+                    "must be either 'all', 'drop_last' or 'top_label'."
+                )
+
+            for array in views:
+                array.flags.writeable = False
+            self._binary_views[view] = views
+
+        return self._binary_views[view]
+
+    def binary(self, drop_last=True):
+        """
+        `(y_true, y_pred, groups)` of the "drop_last" (or "all") `datapoints`.
+        """
+        return self.datapoints("drop_last" if drop_last else "all")[:3]
+
+    def binary_by_time(self, view="drop_last"):
+        """
+        `(timestamp, y_true, y_pred, groups)` of the `datapoints` ordered by the
+        time of their forecast; datapoints of forecasts without a timestamp are
+        left out. Sorted once and shared read-only like `datapoints`.
+        """
+        if view not in self._time_views:
+            y_true, y_pred, groups, forecasts = self.datapoints(view)
+            timestamp = self.timestamp[forecasts]
+
+            known = np.flatnonzero(~np.isnan(timestamp))
+            order = known[np.argsort(timestamp[known], kind="stable")]
+            views = timestamp[order], y_true[order], y_pred[order], groups[order]
+
+            for array in views:
+                array.flags.writeable = False
+            self._time_views[view] = views
+
+        return self._time_views[view]
+
+    def window(self, start=None, end=None, view="drop_last"):
+        """
+        `binary_by_time` restricted to forecasts made in [start, end) (epoch
+        seconds, None for unbounded), as views found by `searchsorted`.
+        """
+        timestamp, y_true, y_pred, groups = self.binary_by_time(view)
+        lo = 0 if start is None else np.searchsorted(timestamp, start, side="left")
+        hi = len(timestamp) if end is None else np.searchsorted(timestamp, end, side="left")
+        return timestamp[lo:hi], y_true[lo:hi], y_pred[lo:hi], groups[lo:hi]
+
+    def brier_scores(self):
+        """
+        Multiclass Brier score of every non-empty forecast.
+        """
+        return multiclass_brier_scores(self.probability, self.outcome, self.forecast_offsets)
+
+    def log_scores(self, eps=1e-3):
+        """
+        Logarithmic score of every non-empty forecast.
+        """
+        return multiclass_log_scores(self.probability, self.outcome, self.forecast_offsets, eps)
+
+
+class ForecastStoreBuilder:
+    """
+    Accumulates questions one by one, e.g. while they are being scraped.
+    """
+
+    def __init__(self):
+        self.qids = []
+        self.forecasts_per_question = []
+        self.options_per_forecast = []
+        self.forecast_offsets = [0]
+        self.probability = []
+        self.outcome = []
+        self.timestamps = []
+
+    def add_question(self, qid, forecasts, resolution):
+        y_true = resolution["y_true"]
+
+        n_forecasts = 0
+        for forecast in forecasts:
+            y_pred = forecast["y_pred"]
+            if len(y_pred) != len(y_true):
+                logging.error(
+                    f"ForecastStoreBuilder.add_question for qid={qid} | "
+                    f"forecast has {len(y_pred)} options, resolution has {len(y_true)}"
+                )
+                continue
+
+            self.options_per_forecast.append(len(y_pred))
+            self.forecast_offsets.append(self.forecast_offsets[-1] + len(y_pred))
+            self.probability.extend(y_pred)
+            self.outcome.extend(y_true)
+            self.timestamps.append(forecast["timestamp"])
+            n_forecasts += 1
+
+        self.qids.append(qid)
+        self.forecasts_per_question.append(n_forecasts)
+
+    @property
+    def n_forecasts(self):
+        return len(self.options_per_forecast)
+
+    def binary_since(self, n_forecasts, drop_last=True):
+        """
+        `(y_true, y_pred)` as in `ForecastStore.binary`, of the forecasts added
+        after the first `n_forecasts` only.
+        """
+        start = self.forecast_offsets[n_forecasts]
+        y_true = np.array(self.outcome[start:], dtype=float)
+        y_pred = np.array(self.probability[start:], dtype=float)
+
+        if drop_last:
+            ends = np.array(self.forecast_offsets[n_forecasts + 1 :], dtype=np.int64) - start
+            sizes = np.array(self.options_per_forecast[n_forecasts:], dtype=np.int64)
+            keep = np.ones(len(y_pred), dtype=bool)
+            keep[ends[sizes > 0] - 1] = False
+            y_true, y_pred = y_true[keep], y_pred[keep]
+
+        return y_true, y_pred
+
+    def build(self):
+        return ForecastStore(
+            self.qids,
+            np.concatenate([[0], np.cumsum(self.forecasts_per_question, dtype=np.int64)]),
+            self.forecast_offsets,
+            self.probability,
+            self.outcome,
+            parse_timestamps(self.timestamps),
+        )
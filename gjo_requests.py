@@ -1,105 +1,288 @@
 import asyncio
+import collections
+import concurrent.futures
+import html
 import logging
+import queue
 import re
+import threading
 from itertools import count
 
-import aiohttp
-import aioitertools
-import requests
-import streamlit as st
-from bs4 import BeautifulSoup
+import tracing
+from memo import memoize
+from scheduler import FetchError, scheduled_session
+from singleflight import coalesce
 
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
+SCORES_PAGES_WINDOW = 4  # how many scores pages are requested ahead speculatively
 
 
-@st.cache
-def get_resolved_questions(uid, platform_url, headers, cookies):
-    logging.info(
-        f"[ ] get_resolved_questions for uid={uid}, platform_url={platform_url}"
+class IncompleteForecasts(FetchError):
+    """
+    A forecast page failed after earlier pages of the question were scraped;
+    `forecasts` holds those, to be resumed from their last page later.
+    """
+
+    def __init__(self, error, forecasts):
+        super().__init__(error.url, error.status, error.reason)
+        self.forecasts = forecasts
+
+_parse_executor = None  # pages are parsed on the event loop unless configured
+
+
+def configure_parsing(workers=0, kind="process"):
+    """
+    Moves page parsing off the event loop into a pool of `workers` processes
+    (kind="process") or threads (kind="thread"), so that parsing overlaps with
+    network I/O. `workers=0` parses inline.
+    """
+    global _parse_executor
+
+    if _parse_executor is not None:
+        _parse_executor.shutdown(wait=False)
+        _parse_executor = None
+
+    if workers > 0:
+        executor_cls = {
+            "process": concurrent.futures.ProcessPoolExecutor,
+            "thread": concurrent.futures.ThreadPoolExecutor,
+        }[kind]
+        _parse_executor = executor_cls(max_workers=workers)
+
+
+async def _parse(extract, page):
+    with tracing.span("parse", extract=extract.__name__, bytes=len(page)):
+        if _parse_executor is None:
+            return extract(page)
+        return await asyncio.get_running_loop().run_in_executor(_parse_executor, extract, page)
+
+
+def _extract_questions_from_scores_page(page):
+    return re.findall("/questions/(\d+)", page)
+
+
+async def _async_iter_question_pages(page_urls, client, window=SCORES_PAGES_WINDOW):
+    """
+    Yields the new question ids linked from every page of `page_urls`, as soon
+    as it arrives.
+
+    Up to `window` pages are kept in flight: whenever the oldest page is consumed
+    the next one is requested. Pagination stops at the first page without
+    questions and the speculative requests beyond it are cancelled.
+    """
+    in_flight = collections.deque(
+        asyncio.ensure_future(client.get_text(next(page_urls))) for _ in range(window)
     )
+    seen = set()
+
+    try:
+        while in_flight:
+            page = await in_flight.popleft()
 
-    questions = []  # [question_id]
+            extracted_qs = _extract_questions_from_scores_page(page)
+            if not extracted_qs:
+                break
 
-    for page_num in count(1):
-        url = f"{platform_url}/memberships/{uid}/scores/?page={page_num}"
-        page = requests.get(url, headers=headers, cookies=cookies).text
+            in_flight.append(asyncio.ensure_future(client.get_text(next(page_urls))))
 
-        extracted_qs = re.findall("/questions/(\d+)", page)
-        questions.extend(extracted_qs)
+            new_qs = [q for q in dict.fromkeys(extracted_qs) if q not in seen]
+            seen.update(new_qs)
+            yield new_qs
+    finally:
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
 
-        if not extracted_qs:
-            break
 
+async def async_iter_scores_pages(
+    uid, platform_url, client, window=SCORES_PAGES_WINDOW
+):
     logging.info(
-        f"[X] get_resolved_questions for uid={uid}, platform_url={platform_url}"
+        f"[ ] async_iter_scores_pages for uid={uid}, platform_url={platform_url}"
+    )
+
+    page_urls = (
+        f"{platform_url}/memberships/{uid}/scores/?page={page_num}"
+        for page_num in count(1)
     )
+    pages = _async_iter_question_pages(page_urls, client, window)
+    try:
+        async for qs in pages:
+            yield qs
+    finally:
+        # cancels the speculative requests when the caller stops early
+        await pages.aclose()
 
-    return questions
+    logging.info(
+        f"[X] async_iter_scores_pages for uid={uid}, platform_url={platform_url}"
+    )
 
 
-async def get_question_resolution(qid, platform_url, session):
+async def async_iter_platform_resolved_questions_pages(
+    platform_url, client, window=SCORES_PAGES_WINDOW
+):
+    """
+    Yields the ids of resolved questions of the whole platform, page by page
+    (most recently resolved first).
+    """
+    page_urls = (
+        f"{platform_url}/questions?status=resolved&page={page_num}"
+        for page_num in count(1)
+    )
+    pages = _async_iter_question_pages(page_urls, client, window)
+    try:
+        async for qs in pages:
+            yield qs
+    finally:
+        await pages.aclose()
+
+
+async def async_iter_new_scores_pages(uid, platform_url, client, known=None):
+    """
+    The user's scores pages, most recently resolved first. With a set of `known`
+    ids it stops at the first page whose questions are all known: the following
+    pages list older questions, known as well.
+    """
+    pages = async_iter_scores_pages(uid, platform_url, client)
+    try:
+        async for qs in pages:
+            if known is not None and all(q in known for q in qs):
+                break
+            yield qs
+    finally:
+        await pages.aclose()
+
+
+async def async_iter_resolved_questions(uid, platform_url, client, known=None):
+    """
+    Yields the ids of the questions of the user's scores pages. With a set of
+    `known` ids it stops at the first page whose questions are all known.
+    """
+    pages = async_iter_new_scores_pages(uid, platform_url, client, known)
+    try:
+        async for qs in pages:
+            for q in qs:
+                yield q
+    finally:
+        await pages.aclose()
+
+
+async def async_get_resolved_questions(uid, platform_url, headers, cookies, known=None):
+    async with scheduled_session(headers, cookies) as client:
+        return [
+            q
+            async for q in async_iter_resolved_questions(uid, platform_url, client, known)
+        ]
+
+
+@memoize(
+    key=lambda uid, platform_url, headers, cookies, known=None: (
+        platform_url,
+        uid,
+        None if known is None else frozenset(known),
+    )
+)
+def get_resolved_questions(uid, platform_url, headers, cookies, known=None):
+    """
+    The user's resolved questions; with `known` ids only those listed before the
+    first page of known questions (i.e. the new ones of a returning user).
+    """
+    return asyncio.run(
+        async_get_resolved_questions(uid, platform_url, headers, cookies, known)
+    )
+
+
+def _extract_resolution_from_page(page):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page, "html.parser")
+    soup = soup.find_all("div", {"id": "prediction-interface-container"})[0]
+
+    binary = soup.find_all("div", {"class": "binary-probability-value"})
+    if binary:
+        y_true = (0, 1) if re.search("Yes", binary[1].text) is None else (1, 0)
+    else:
+        tables = soup.find_all("table")
+        y_true = tuple(len(tr.findAll("i")) for tr in tables[0].findAll("tr")[1:])
+
+    return {"y_true": y_true}
+
+
+@tracing.traced("scrape.resolution")
+@coalesce(key=lambda qid, platform_url, client: (platform_url, "resolution", qid))
+async def get_question_resolution(qid, platform_url, client):
     logging.info(
         f"[ ] get_question_resolution for qid={qid}, platform_url={platform_url}"
     )
 
     url = f"{platform_url}/questions/{qid}"
 
-    async with session.get(url) as resp:
-        if resp.status != 200:
-            logging.error(
-                f"get_question_resolution for uid={uid}, platform_url={platform_url} | "
-                f"resp.status == {resp.status} → {resp.reason}"
-            )
+    page = await client.get_text(url)
+    resolution = await _parse(_extract_resolution_from_page, page)
+    tracing.annotate(qid=qid)
 
-        page = await resp.text()
+    logging.info(
+        f"[X] get_question_resolution for qid={qid}, platform_url={platform_url}"
+    )
+    return resolution
+
+
+# A single pass over a prediction_sets page visits, in document order: the
+# "made their Nth forecast" lines, the timestamps which follow them on a later
+# line, and the opening tags of the `prediction-values` divs.
+_FORECAST_PAGE_EVENTS = re.compile(
+    r"(?P<forecast>made their \d+(?:st|nd|rd|th) forecast)"
+    r'|<span data-localizable-timestamp="(?P<timestamp>[^"\n]+)">'
+    r'|(?P<values><div\b[^>]*\bclass="(?:[^"]*\s)?prediction-values(?:\s[^"]*)?"[^>]*>)',
+    re.IGNORECASE,
+)
+_DIV_TAG = re.compile(r"<(/?)div\b", re.IGNORECASE)
+_TAG = re.compile(r"<[^>]*>")
+_PROBABILITY = re.compile(r"\n\s*(\d+)%")
+
+
+def _div_inner_html(page, start):
+    """
+    Returns the content of a div whose opening tag ends at `start`.
+    """
+    depth = 1
+    for tag in _DIV_TAG.finditer(page, start):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return page[start : tag.start()]
+    return page[start:]
 
-        soup = BeautifulSoup(page, "html.parser")
-        soup = soup.find_all("div", {"id": "prediction-interface-container"})[0]
 
-        binary = soup.find_all("div", {"class": "binary-probability-value"})
-        if binary:
-            y_true = (0, 1) if re.search("Yes", binary[1].text) is None else (1, 0)
-        else:
-            tables = soup.find_all("table")
-            y_true = tuple(len(tr.findAll("i")) for tr in tables[0].findAll("tr")[1:])
+def _extract_forecasts_from_page(page):
+    predictions, timestamps = [], []
 
-        logging.info(
-            f"[X] get_question_resolution for qid={qid}, platform_url={platform_url}"
-        )
-        return {"y_true": y_true}
+    looking_for_a_forecast = True
+    forecast_line = timestamp_line = None  # start offsets of the relevant lines
 
+    for event in _FORECAST_PAGE_EVENTS.finditer(page):
+        kind = event.lastgroup
+        line = page.rfind("\n", 0, event.start())
 
-def _extract_forecasts_from_page(page):
-    soup = BeautifulSoup(page, "html.parser")
-    soup_predictions = soup.find_all("div", {"class": "prediction-values"})
-    predictions = [re.findall("\n\s*(\d+)%", p_tag.text) for p_tag in soup_predictions]
-    predictions = [tuple(int(prob) / 100 for prob in pred) for pred in predictions]
-    predictions = [
-        (pred[0], 1 - pred[0]) if len(pred) == 1 else pred for pred in predictions
-    ]
+        if kind == "values":
+            text = html.unescape(_TAG.sub("", _div_inner_html(page, event.end())))
+            pred = tuple(int(prob) / 100 for prob in _PROBABILITY.findall(text))
+            predictions.append((pred[0], 1 - pred[0]) if len(pred) == 1 else pred)
 
-    # I search for a line containing "made a forecast"
-    # I search for the next line containig <span data-localizable-timestamp="[^"]*">
-    # And graab a timestamp from it
-    timestamps = []
-    looking_for_a_forecast = True
-    for line in page.split("\n"):
-        if looking_for_a_forecast:
-            hit = re.findall("made their \d+(st|nd|rd|th) forecast", line)
-            if hit:
+        elif kind == "forecast":
+            if looking_for_a_forecast and line != timestamp_line:
                 looking_for_a_forecast = False
+                forecast_line = line
 
-        else:
-            hit = re.findall('<span data-localizable-timestamp="([^"]+)">', line)
-            if hit:
-                timestamps.extend(hit)
-                looking_for_a_forecast = True
+        # A timestamp counts if it is on a line after the forecast's one (or on
+        # the same line as a timestamp which has just been taken).
+        elif (not looking_for_a_forecast and line != forecast_line) or line == timestamp_line:
+            timestamps.append(event.group("timestamp"))
+            looking_for_a_forecast = True
+            timestamp_line = line
 
     if len(timestamps) != len(predictions):
         logging.error(
-            f"In _extract_forecasts_from_page with uid={uid}, qid={qid}, page_num={page_num} "
-            f"got different number of predictions ({len(timestamps)}) and timestamps ({len(predictions)})."
+            f"In _extract_forecasts_from_page got different number of "
+            f"predictions ({len(predictions)}) and timestamps ({len(timestamps)})."
         )
 
     return [
@@ -108,31 +291,50 @@ def _extract_forecasts_from_page(page):
     ]
 
 
-async def get_forecasts_on_the_question(uid, qid, platform_url, session):
+@tracing.traced("scrape.forecasts")
+@coalesce(
+    key=lambda uid, qid, platform_url, client, known=None: (platform_url, "forecasts", qid, uid)
+)
+async def get_forecasts_on_the_question(uid, qid, platform_url, client, known=None):
+    """
+    Every forecast remembers the page it was found on. Given the `known` record
+    of an earlier, incomplete call ({"forecasts": [...], "last_page": int}),
+    only its last page and the pages after it are fetched. A failure after some
+    pages raises `IncompleteForecasts` with the forecasts found so far.
+
+    Concurrent calls for the same question and user (e.g. from several sessions)
+    share one fetch and its result, which must not be mutated.
+    """
     logging.info(
         f"[ ] get_forecasts_on_the_question for uid={uid}, qid={qid}, platform_url={platform_url}"
     )
 
-    forecasts = []  # [{"y_pred": (probs, ...), "timestamp": timestamp}, ...]
+    forecasts = []  # [{"y_pred": (probs, ...), "timestamp": timestamp, "page": page_num}, ...]
 
-    for page_num in count(1):
-        url = f"{platform_url}/questions/{qid}/prediction_sets?membership_id={uid}&page={page_num}"
+    first_page = 1
+    if known:
+        first_page = max(1, known["last_page"])
+        forecasts = [f for f in known["forecasts"] if f.get("page", 1) < first_page]
 
-        async with session.get(url) as resp:
-            if resp.status != 200:
-                logging.error(
-                    f"get_forecasts_on_the_question for uid={uid}, qid={qid}, platform_url={platform_url} | "
-                    f"resp.status == {resp.status} → {resp.reason}"
-                )
+    for page_num in count(first_page):
+        url = f"{platform_url}/questions/{qid}/prediction_sets?membership_id={uid}&page={page_num}"
 
-            page = await resp.text()
+        try:
+            page = await client.get_text(url)
+        except FetchError as e:
+            if forecasts:
+                raise IncompleteForecasts(e, forecasts) from e
+            raise
 
-            extracted_forecasts = _extract_forecasts_from_page(page)
-            forecasts.extend(extracted_forecasts)
+        extracted_forecasts = await _parse(_extract_forecasts_from_page, page)
+        for forecast in extracted_forecasts:
+            forecast["page"] = page_num
+        forecasts.extend(extracted_forecasts)
 
-            if not extracted_forecasts:
-                break
+        if not extracted_forecasts:
+            break
 
+    tracing.annotate(qid=qid, pages=page_num - first_page + 1, forecasts=len(forecasts))
     logging.info(
         f"[X] get_forecasts_on_the_question for uid={uid}, qid={qid}, platform_url={platform_url}"
     )
@@ -142,30 +344,38 @@ async def get_forecasts_on_the_question(uid, qid, platform_url, session):
 # ---
 
 
-async def async_get_forecasts(uid, questions, platform_url, headers, cookies):
-    async with aiohttp.ClientSession(headers=headers, cookies=cookies) as session:
-        forecasts_list = await aioitertools.asyncio.gather(
+async def async_get_forecasts(
+    uid, questions, platform_url, headers, cookies, known_records=None
+):
+    known_records = dict() if known_records is None else known_records
+
+    async with scheduled_session(headers, cookies) as client:
+        forecasts_list = await asyncio.gather(
             *[
-                get_forecasts_on_the_question(uid, q, platform_url, session)
+                get_forecasts_on_the_question(
+                    uid, q, platform_url, client, known=known_records.get(q)
+                )
                 for q in questions
-            ],
-            limit=5,
+            ]
         )
         return {q: forecasts_list[i] for i, q in enumerate(questions)}
 
 
 async def async_get_resolutions(questions, platform_url, headers, cookies):
-    async with aiohttp.ClientSession(headers=headers, cookies=cookies) as session:
-        resolutions_list = await aioitertools.asyncio.gather(
-            *[get_question_resolution(q, platform_url, session) for q in questions],
-            limit=5,
+    async with scheduled_session(headers, cookies) as client:
+        resolutions_list = await asyncio.gather(
+            *[get_question_resolution(q, platform_url, client) for q in questions]
         )
         return {q: resolutions_list[i] for i, q in enumerate(questions)}
 
 
-def request_forecasts(uid, missing_forecasts_qs, platform_url, headers, cookies):
+def request_forecasts(
+    uid, missing_forecasts_qs, platform_url, headers, cookies, known_records=None
+):
     return asyncio.run(
-        async_get_forecasts(uid, missing_forecasts_qs, platform_url, headers, cookies)
+        async_get_forecasts(
+            uid, missing_forecasts_qs, platform_url, headers, cookies, known_records
+        )
     )
 
 
@@ -173,3 +383,202 @@ def request_resolutions(missing_resolutions_qs, platform_url, headers, cookies):
     return asyncio.run(
         async_get_resolutions(missing_resolutions_qs, platform_url, headers, cookies)
     )
+
+
+# ---
+
+
+async def _value(value):
+    return value
+
+
+def _no_lookup(qs):
+    return dict()
+
+
+def _no_store(qid, forecasts):
+    pass
+
+
+async def async_stream_user_data(
+    uid,
+    platform_url,
+    headers,
+    cookies,
+    lookup_forecasts=_no_lookup,
+    lookup_resolutions=_no_lookup,
+    store_incomplete=_no_store,
+    known=None,
+    n_workers=None,
+    progress=None,
+):
+    """
+    Yields (qid, forecasts, resolution) for every resolved question of the user
+    as soon as both are available.
+
+    Scores pagination, forecast pages and question pages share one session and
+    run concurrently: question ids are pushed into a bounded work queue as the
+    scores pages arrive and `n_workers` workers fetch forecasts and resolution
+    of each question at the same time. There are as many workers as the
+    session's concurrency ceiling by default, so that its adaptive limiter,
+    not the pool, decides how many requests are in flight.
+
+    `lookup_forecasts(qs)` and `lookup_resolutions(qs)` are blocking cache reads
+    called (in a thread) with the new question ids of every scores page; they
+    return `{qid: {"forecasts": [...], "last_page": int, "complete": bool}}`
+    and `{qid: resolution}`. Complete forecasts and found resolutions are not
+    requested again, incomplete forecasts are resumed from their last page.
+    `store_incomplete(qid, forecasts)` is a blocking cache write called (in a
+    thread) with the forecasts of a question whose later pages failed.
+
+    `known` are the question ids listed for the user before (e.g. on the last
+    visit): scores pagination stops at the first page of known questions, and
+    the known questions not listed by then are looked up and fetched as if they
+    were on one last page.
+
+    `progress`, if given, is a dict kept up to date (it can be read from another
+    thread) with the number of questions "found" so far, of those "done" and
+    "failed", and whether all of them are "listed" already.
+    """
+    loop = asyncio.get_running_loop()
+
+    progress = dict() if progress is None else progress
+    progress.update(found=0, done=0, failed=0, listed=False)
+
+    async with scheduled_session(headers, cookies) as client:
+        n_workers = client.max_concurrency if n_workers is None else n_workers
+
+        # Both queues are bounded: workers wait for the consumer instead of
+        # scraping ahead of it.
+        work = asyncio.Queue(maxsize=n_workers)
+        results = asyncio.Queue(maxsize=n_workers)
+
+        async def add_work(qs):
+            known_forecasts, known_resolutions = await asyncio.gather(
+                loop.run_in_executor(None, tracing.in_context(lookup_forecasts), qs),
+                loop.run_in_executor(None, tracing.in_context(lookup_resolutions), qs),
+            )
+            progress["found"] += len(qs)
+            for q in qs:
+                await work.put((q, known_forecasts.get(q), known_resolutions.get(q)))
+
+        async def produce():
+            known_qs = None if known is None else set(known)
+            listed = set()
+            async for qs in async_iter_new_scores_pages(uid, platform_url, client, known_qs):
+                if not qs:
+                    continue
+                listed.update(qs)
+                await add_work(qs)
+
+            rest = [q for q in known or () if q not in listed]
+            if rest:
+                await add_work(rest)
+            progress["listed"] = True
+            for _ in range(n_workers):
+                await work.put(None)
+
+        async def consume():
+            while True:
+                item = await work.get()
+                if item is None:
+                    break
+                q, record, resolution = item
+
+                try:
+                    forecasts, resolution = await asyncio.gather(
+                        _value(record["forecasts"])
+                        if record is not None and record["complete"]
+                        else get_forecasts_on_the_question(
+                            uid, q, platform_url, client, known=record
+                        ),
+                        _value(resolution)
+                        if resolution is not None
+                        else get_question_resolution(q, platform_url, client),
+                    )
+                except FetchError as e:
+                    logging.error(f"async_stream_user_data skips qid={q} | {e}")
+                    progress["failed"] += 1
+                    if isinstance(e, IncompleteForecasts):
+                        await loop.run_in_executor(
+                            None, tracing.in_context(store_incomplete), q, e.forecasts
+                        )
+                    continue
+
+                await results.put((q, forecasts, resolution))
+
+        tasks = [asyncio.ensure_future(produce())]
+        tasks.extend(asyncio.ensure_future(consume()) for _ in range(n_workers))
+        all_done = asyncio.gather(*tasks)
+        all_done.add_done_callback(lambda _: asyncio.ensure_future(results.put(None)))
+
+        try:
+            while True:
+                item = await results.get()
+                if item is None:
+                    break
+                progress["done"] += 1
+                yield item
+
+            await all_done  # re-raises the first failure of a stage, if any
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(all_done, return_exceptions=True)
+
+            logging.info(f"async_stream_user_data for uid={uid} | {client.stats}")
+
+
+def stream_user_data(uid, platform_url, headers, cookies, max_pending=100, **kwargs):
+    """
+    A synchronous view of `async_stream_user_data`.
+
+    The pipeline runs on its own event loop in a background thread, so the caller
+    (e.g. a Streamlit script) can consume the results as they come. At most
+    `max_pending` results wait for the caller; once the caller stops consuming
+    (closes the generator) the pipeline is cancelled.
+    """
+    results = queue.Queue()
+    done = object()
+    pipeline = dict()  # the loop, the task and the result slots of the pipeline
+
+    async def pump():
+        slots = asyncio.Semaphore(max_pending)
+        pipeline.update(loop=asyncio.get_running_loop(), task=asyncio.current_task(), slots=slots)
+
+        async for item in async_stream_user_data(
+            uid, platform_url, headers, cookies, **kwargs
+        ):
+            await slots.acquire()
+            results.put(item)
+
+    def run():
+        try:
+            asyncio.run(pump())
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(done)
+
+    def call_in_pipeline(callback):
+        try:
+            pipeline["loop"].call_soon_threadsafe(callback)
+        except RuntimeError:  # the loop is closed, the pipeline is over
+            pass
+
+    threading.Thread(target=tracing.in_context(run), daemon=True).start()
+
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            call_in_pipeline(pipeline["slots"].release)
+            yield item
+    finally:
+        if "task" in pipeline:
+            call_in_pipeline(pipeline["task"].cancel)
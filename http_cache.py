@@ -0,0 +1,160 @@
+"""
+On-disk cache of HTTP responses for conditional requests.
+
+The body of every response carrying an ETag or a Last-Modified header is stored
+zlib-compressed in a SQLite file, keyed by the URL alone: cookies and headers
+are not part of the key, so the entries are shared by every session. The next
+request for the URL revalidates the entry with If-None-Match/If-Modified-Since
+and, on 304 Not Modified, the stored body is used instead of a download.
+
+Entries stored more than `max_age` seconds ago are dropped, and so are the
+oldest ones beyond `max_entries`; both are checked when the file is opened and
+every `EVICT_INTERVAL` stores.
+"""
+import collections
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60  # seconds
+EVICT_INTERVAL = 1000  # stores
+
+CachedResponse = collections.namedtuple("CachedResponse", "etag last_modified text size")
+
+
+def conditional_headers(cached):
+    """
+    The request headers revalidating `cached` (a `CachedResponse` or None).
+    """
+    headers = dict()
+    if cached is not None:
+        if cached.etag is not None:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified is not None:
+            headers["If-Modified-Since"] = cached.last_modified
+    return headers
+
+
+class HTTPCache:
+    """
+    Safe to call from several threads; the file is opened on first use.
+
+    `stats` counts lookups, revalidated responses (`not_modified`), stored
+    responses, `bytes_saved`, the size of the bodies served from the cache,
+    and evicted entries.
+    """
+
+    def __init__(
+        self,
+        path,
+        compression_level=6,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        max_age=DEFAULT_MAX_AGE,
+    ):
+        self.path = path
+        self.compression_level = compression_level
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._connection = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "lookups": 0,
+            "not_modified": 0,
+            "stores": 0,
+            "bytes_saved": 0,
+            "evictions": 0,
+        }
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+                "body BLOB, size INTEGER, stored_at REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)"
+            )
+            connection.commit()
+            self._connection = connection
+            self._evict()
+        return self._connection
+
+    def _evict(self):
+        # with self._lock held
+        connection = self._connect()
+        with connection:
+            expired = connection.execute(
+                "DELETE FROM responses WHERE stored_at < ?", (time.time() - self.max_age,)
+            )
+            oldest = connection.execute(
+                "DELETE FROM responses WHERE url IN ("
+                "SELECT url FROM responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        self.stats["evictions"] += expired.rowcount + oldest.rowcount
+
+    def evict(self):
+        """
+        Drops the expired entries and the oldest ones beyond `max_entries`.
+        """
+        with self._lock:
+            self._evict()
+
+    def lookup(self, url):
+        """
+        The `CachedResponse` stored for `url`, or None.
+        """
+        with self._lock:
+            self.stats["lookups"] += 1
+            row = self._connect().execute(
+                "SELECT etag, last_modified, body, size FROM responses "
+                "WHERE url = ? AND stored_at >= ?",
+                (url, time.time() - self.max_age),
+            ).fetchone()
+
+        if row is None:
+            return None
+        etag, last_modified, body, size = row
+        return CachedResponse(etag, last_modified, zlib.decompress(body).decode(), size)
+
+    def store(self, url, headers, text):
+        """
+        Stores the body `text` of a 200 response with `headers`, if it has
+        validators to revalidate it with. Returns whether it was stored.
+        """
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if etag is None and last_modified is None:
+            return False
+
+        body = text.encode()
+        compressed = zlib.compress(body, self.compression_level)
+        with self._lock:
+            self.stats["stores"] += 1
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (url, etag, last_modified, compressed, len(body), time.time()),
+                )
+            if self.stats["stores"] % EVICT_INTERVAL == 0:
+                self._evict()
+        return True
+
+    def not_modified(self, cached):
+        """
+        Records that `cached` was revalidated and returns its body.
+        """
+        with self._lock:
+            self.stats["not_modified"] += 1
+            self.stats["bytes_saved"] += cached.size
+        return cached.text
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
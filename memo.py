@@ -0,0 +1,83 @@
+import collections
+import functools
+import threading
+import time
+
+
+DEFAULT_MAXSIZE = 256
+DEFAULT_TTL = 15 * 60  # seconds
+
+
+class TTLCache:
+    """
+    A bounded LRU mapping whose entries expire `ttl` seconds after being put.
+    Values are returned as they are, without copying, so callers must not
+    mutate them. `stats` counts hits, misses, evictions and expirations.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()  # {key: (expires_at, value)}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.stats["expirations"] += 1
+                entry = None
+
+            if entry is None:
+                self.stats["misses"] += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_MISSING = object()
+
+
+def memoize(key, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+    """
+    Caches the results of the decorated function in a `TTLCache` under
+    `key(*args, **kwargs)`, so that arguments which do not identify the result
+    (e.g. headers and cookies) stay out of the key. The cache is exposed as
+    `.cache` on the wrapper.
+    """
+
+    def decorator(func):
+        cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            value = cache.get(cache_key, _MISSING)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                cache.put(cache_key, value)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
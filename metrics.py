@@ -0,0 +1,109 @@
+"""
+Scores of binary forecasts computed together in one pass over the arrays: the
+datapoints are binned once (as in `calibration.calibration_curve`) and every
+binned metric is read off the same per-bin sums.
+"""
+import numpy as np
+
+import tracing
+from calibration import bin_edges
+
+METRICS = [
+    "brier",
+    "log",
+    "reliability",
+    "resolution",
+    "uncertainty",
+    "ece",
+    "mce",
+    "overconfidence",
+]
+
+
+@tracing.traced("metrics.scores")
+def scores(y_true, y_prob, *, n_bins=10, strategy="uniform", sample_weight=None, eps=1e-3):
+    """
+    Returns a dict with
+
+    - "brier" and "log": mean Brier score and mean logarithmic score (with
+      probabilities clipped to [eps, 1 - eps]);
+    - "reliability", "resolution" and "uncertainty": the Murphy decomposition of
+      the Brier score over the bins, brier ≈ reliability - resolution + uncertainty
+      (exactly when the forecasts in a bin are equal);
+    - "ece" and "mce": mean and maximal distance between the fraction of
+      positives and the mean prediction of a bin, the mean weighted by bin sizes;
+    - "overconfidence": `calibration.overconfidence`, positive when too confident.
+
+    With `sample_weight` every mean is weighted.
+    """
+    y_true = np.asarray(y_true, dtype=float)
+    y_prob = np.asarray(y_prob, dtype=float)
+    weight = np.ones(len(y_prob)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+
+    total = weight.sum()
+    if len(y_prob) == 0 or total == 0:
+        return {metric: np.nan for metric in METRICS}
+
+    bins = bin_edges(y_prob, n_bins, strategy)
+    binids = np.digitize(y_prob, bins) - 1
+
+    # Per-bin sums shared by the binned metrics.
+    bin_total = np.bincount(binids, weights=weight, minlength=len(bins))
+    bin_true = np.bincount(binids, weights=weight * y_true, minlength=len(bins))
+    bin_prob = np.bincount(binids, weights=weight * y_prob, minlength=len(bins))
+
+    nonzero = bin_total != 0
+    bin_total, bin_true, bin_prob = bin_total[nonzero], bin_true[nonzero], bin_prob[nonzero]
+    fraction_of_positives = bin_true / bin_total
+    mean_predicted_value = bin_prob / bin_total
+    base_rate = bin_true.sum() / total
+
+    gap = np.abs(fraction_of_positives - mean_predicted_value)
+
+    clipped = np.clip(y_prob, eps, 1 - eps)
+    log_loss = -(y_true * np.log(clipped) + (1 - y_true) * np.log(1 - clipped))
+
+    # Overconfidence compares the probability given to what happened with 1/2.
+    x = y_prob * y_true + (1 - y_prob) * (1 - y_true)
+
+    return {
+        "brier": np.dot(weight, (y_prob - y_true) ** 2) / total,
+        "log": np.dot(weight, log_loss) / total,
+        "reliability": np.dot(bin_total, (mean_predicted_value - fraction_of_positives) ** 2) / total,
+        "resolution": np.dot(bin_total, (fraction_of_positives - base_rate) ** 2) / total,
+        "uncertainty": base_rate * (1 - base_rate),
+        "ece": np.dot(bin_total, gap) / total,
+        "mce": gap.max(),
+        "overconfidence": np.dot(weight, (x - 1) * (x - 0.5)) / np.dot(weight, (x - 0.5) ** 2),
+    }
+
+
+def scores_by_group(y_true, y_prob, groups, eps=1e-3, sample_weight=None):
+    """
+    `(group, count, brier, log)` arrays: the mean Brier and logarithmic scores of
+    the datapoints of every group (e.g. question), weighted by `sample_weight`
+    if given, summed with `np.add.reduceat` over the datapoints sorted by group.
+    """
+    y_true = np.asarray(y_true, dtype=float)
+    y_prob = np.asarray(y_prob, dtype=float)
+    groups = np.asarray(groups)
+    if len(groups) == 0:
+        return groups, np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+
+    weight = np.ones(len(groups)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+
+    # Datapoints of a ForecastStore are already grouped by question.
+    if np.any(groups[1:] < groups[:-1]):
+        order = np.argsort(groups, kind="stable")
+        y_true, y_prob, groups, weight = y_true[order], y_prob[order], groups[order], weight[order]
+
+    starts = np.flatnonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))
+    count = np.diff(np.append(starts, len(groups)))
+    total_weight = np.add.reduceat(weight, starts)
+
+    clipped = np.clip(y_prob, eps, 1 - eps)
+    log_loss = -(y_true * np.log(clipped) + (1 - y_true) * np.log(1 - clipped))
+    brier = np.add.reduceat(weight * (y_prob - y_true) ** 2, starts) / total_weight
+    log = np.add.reduceat(weight * log_loss, starts) / total_weight
+
+    return groups[starts], count, brier, log
@@ -1,26 +1,134 @@
+# plotly is slow to import, so it is imported by the functions drawing figures.
 import numpy as np
-import plotly.graph_objects as go
 
-from calibration import calibration_curve
+import tracing
+from calibration import bin_edges, bootstrap_interval, calibration_curve, wilson_interval
 
+ERROR_BARS_TITLES = {
+    "std": "± std",
+    "wilson": "Wilson interval",
+    "bootstrap": "question-level bootstrap",
+}
 
-def plotly_calibration(y_true, y_pred, n_bins, strategy="quantile"):
-    fraction_of_positives, mean_predicted_value, counts = calibration_curve(
-        y_true, y_pred, n_bins=n_bins, strategy=strategy
+
+# Traces with more points than this are drawn with WebGL.
+WEBGL_THRESHOLD = 1000
+# Plots are aggregated (fewer bins) or downsampled to at most this many points
+# before they are serialized.
+MAX_POINTS = 2000
+
+
+def _scatter(n_points, render="auto", **kwargs):
+    """
+    `go.Scatter`, or `go.Scattergl` for `render="webgl"` or "auto" with more
+    than `WEBGL_THRESHOLD` points.
+    """
+    import plotly.graph_objects as go
+
+    webgl = render == "webgl" or (render == "auto" and n_points > WEBGL_THRESHOLD)
+    return (go.Scattergl if webgl else go.Scatter)(**kwargs)
+
+
+def _compact(values, decimals=5):
+    # Shorter numbers in the JSON sent to the browser.
+    return np.round(np.asarray(values, dtype=float), decimals)
+
+
+def _odds_labels(log_odds):
+    """
+    e.g. 1 → "2.0 : 1", -1 → "1 : 2.0"
+    """
+    ratio = np.char.mod("%.1f", 2.0 ** np.abs(log_odds))
+    return np.where(log_odds > 0, np.char.add(ratio, " : 1"), np.char.add("1 : ", ratio))
+
+
+def _curve(y_true, y_pred, n_bins, strategy, engine, sample_weight=None):
+    if engine is None:
+        return calibration_curve(
+            y_true, y_pred, n_bins=n_bins, strategy=strategy, sample_weight=sample_weight
+        )
+    return engine.curve(n_bins=n_bins, strategy=strategy)
+
+
+def _error_bounds(
+    y_true,
+    y_pred,
+    fraction_of_positives,
+    counts,
+    n_bins,
+    strategy,
+    engine,
+    errors,
+    groups,
+    sample_weight=None,
+):
+    if errors == "std":
+        error_y = np.sqrt((fraction_of_positives) * (1 - fraction_of_positives) / counts)
+        return fraction_of_positives - error_y, fraction_of_positives + error_y
+
+    if errors == "wilson":
+        return wilson_interval(fraction_of_positives * counts, counts)
+
+    if errors == "bootstrap":
+        if engine is None:
+            bins = bin_edges(y_pred, n_bins, strategy)
+        else:
+            bins = engine.bin_edges(n_bins, strategy)
+        groups = np.arange(len(y_pred)) if groups is None else groups
+        return bootstrap_interval(y_true, y_pred, groups, bins, sample_weight=sample_weight)
+
+    raise ValueError(
+        "Invalid entry to 'errors' input. Errors "
+        "must be either 'std', 'wilson' or 'bootstrap'."
+    )
+
+
+@tracing.traced("plot.calibration")
+def plotly_calibration(
+    y_true,
+    y_pred,
+    n_bins,
+    strategy="quantile",
+    engine=None,
+    errors="std",
+    groups=None,
+    sample_weight=None,
+    render="auto",
+    max_points=MAX_POINTS,
+):
+    """
+    `errors` selects the error bars: binomial "std", "wilson" score interval or
+    "bootstrap" over `groups` (e.g. question of each datapoint). `engine`, if
+    given, has to be built with the same `sample_weight`.
+
+    `render` is "svg", "webgl" or "auto"; at most `max_points` bins are drawn.
+    """
+    n_bins = min(n_bins, max_points)
+    fraction_of_positives, mean_predicted_value, counts = _curve(
+        y_true, y_pred, n_bins, strategy, engine, sample_weight
+    )
+    lower, upper = _error_bounds(
+        y_true, y_pred, fraction_of_positives, counts, n_bins, strategy, engine, errors, groups,
+        sample_weight,
     )
-    error_y = np.sqrt((fraction_of_positives) * (1 - fraction_of_positives) / counts)
+
+    import plotly.graph_objects as go
 
     fig = go.Figure()
 
     fig.add_trace(
-        go.Scatter(
-            x=mean_predicted_value,
-            y=fraction_of_positives,
-            customdata=counts,
+        _scatter(
+            len(counts),
+            render,
+            x=_compact(mean_predicted_value),
+            y=_compact(fraction_of_positives),
+            customdata=_compact(counts),
             mode="markers",
             error_y=dict(
                 type="data",
-                array=error_y,
+                symmetric=False,
+                array=_compact(upper - fraction_of_positives),
+                arrayminus=_compact(fraction_of_positives - lower),
                 thickness=1.5,
                 width=3,
             ),
@@ -28,7 +136,7 @@ def plotly_calibration(y_true, y_pred, n_bins, strategy="quantile"):
                 [
                     "x: %{x:.3f}",
                     "y: %{y:.3f}",
-                    "N: %{customdata}",
+                    "N: %{customdata:.4~g}",
                     "<extra></extra>",
                 ]
             ),
@@ -55,7 +163,7 @@ def plotly_calibration(y_true, y_pred, n_bins, strategy="quantile"):
         height=800,
         title="Calibration plot",
         xaxis_title="Mean predicted value",
-        yaxis_title="Fraction of positives (± std)",
+        yaxis_title=f"Fraction of positives ({ERROR_BARS_TITLES[errors]})",
     )
 
     fig.update_xaxes(
@@ -81,43 +189,61 @@ def transform(x):
     return np.log2(1 / (1 - x) - 1)
     
 
-def plotly_calibration_odds(y_true, y_pred, n_bins, strategy="quantile"):
+def clip_for_odds(y_true, y_pred):
     y_pred = np.clip(y_pred, 0.005, 0.995)  # clipping to avoid undefined odds
     y_true = np.clip(y_true, 1e-3, 1 - 1e-3)
-    fraction_of_positives, mean_predicted_value, counts = calibration_curve(
-        y_true, y_pred, n_bins=n_bins, strategy=strategy
+    return y_true, y_pred
+
+
+@tracing.traced("plot.calibration_odds")
+def plotly_calibration_odds(
+    y_true,
+    y_pred,
+    n_bins,
+    strategy="quantile",
+    engine=None,
+    errors="std",
+    groups=None,
+    sample_weight=None,
+    render="auto",
+    max_points=MAX_POINTS,
+):
+    """
+    `engine`, if given, has to be built from `clip_for_odds(y_true, y_pred)` and
+    `sample_weight`. See `plotly_calibration` for the other arguments.
+    """
+    n_bins = min(n_bins, max_points)
+    y_true, y_pred = clip_for_odds(y_true, y_pred)
+    fraction_of_positives, mean_predicted_value, counts = _curve(
+        y_true, y_pred, n_bins, strategy, engine, sample_weight
+    )
+    lower, upper = _error_bounds(
+        y_true, y_pred, fraction_of_positives, counts, n_bins, strategy, engine, errors, groups,
+        sample_weight,
     )
-    error_y = np.sqrt((fraction_of_positives) * (1 - fraction_of_positives) / counts)
+
+    import plotly.graph_objects as go
 
     fig = go.Figure()
 
-    customdata = np.dstack(
-        [
-            counts,
-            [
-                f"{2**x:.1f} : 1" if x > 0 else f"1 : {2**-x:.1f}"
-                for x in transform(mean_predicted_value)
-            ],
-            [
-                f"{2**x:.1f} : 1" if x > 0 else f"1 : {2**-x:.1f}"
-                for x in transform(fraction_of_positives)
-            ],
-        ]
-    ).squeeze()
+    x, y = transform(mean_predicted_value), transform(fraction_of_positives)
+    customdata = np.column_stack(
+        [np.char.mod("%.6g", counts), _odds_labels(x), _odds_labels(y)]
+    )
 
     fig.add_trace(
-        go.Scatter(
-            x=transform(mean_predicted_value),
-            y=transform(fraction_of_positives),
+        _scatter(
+            len(counts),
+            render,
+            x=_compact(x),
+            y=_compact(y),
             customdata=customdata,
             mode="markers",
             error_y=dict(
                 type="data",
                 symmetric=False,
-                array=transform(fraction_of_positives + error_y)
-                - transform(fraction_of_positives),
-                arrayminus=transform(fraction_of_positives)
-                - transform(fraction_of_positives - error_y),
+                array=_compact(transform(upper) - y),
+                arrayminus=_compact(y - transform(lower)),
                 thickness=1.5,
                 width=3,
             ),
@@ -152,7 +278,7 @@ def plotly_calibration_odds(y_true, y_pred, n_bins, strategy="quantile"):
         height=800,
         title="Calibration plot in terms of odds",
         xaxis_title="Mean predicted value",
-        yaxis_title="Fraction of positives (± std)",
+        yaxis_title=f"Fraction of positives ({ERROR_BARS_TITLES[errors]})",
     )
 
     fig.update_xaxes(
@@ -177,3 +303,99 @@ def plotly_calibration_odds(y_true, y_pred, n_bins, strategy="quantile"):
     )
 
     return fig
+
+
+@tracing.traced("plot.calibration_over_time")
+def plotly_calibration_over_time(
+    starts, window, prob_true, prob_pred, counts, render="auto", max_points=MAX_POINTS
+):
+    """
+    Calibration error of every window of `calibration.rolling_calibration`: the
+    mean distance between the fraction of positives and the mean prediction
+    over the bins, weighted by the bins' sizes. Windows are drawn at their
+    middles; if there are more than `max_points` of them, evenly spaced ones.
+    """
+    if len(starts) > max_points:
+        keep = np.linspace(0, len(starts) - 1, max_points).round().astype(int)
+        starts, prob_true, prob_pred, counts = (
+            starts[keep], prob_true[keep], prob_pred[keep], counts[keep]
+        )
+
+    totals = counts.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        error = np.nansum(counts * np.abs(prob_true - prob_pred), axis=1) / totals
+    middles = ((starts + window / 2) * 1e9).astype("datetime64[ns]")
+
+    import plotly.graph_objects as go
+
+    fig = go.Figure(
+        _scatter(
+            len(starts),
+            render,
+            x=middles,
+            y=_compact(np.where(totals > 0, error, np.nan)),
+            customdata=_compact(totals),
+            mode="lines+markers",
+            connectgaps=False,
+            hovertemplate="<br>".join(
+                [
+                    "%{x|%Y-%m-%d}",
+                    "error: %{y:.3f}",
+                    "N: %{customdata:.4~g}",
+                    "<extra></extra>",
+                ]
+            ),
+            showlegend=False,
+        )
+    )
+
+    fig.update_layout(
+        title=f"Calibration over time ({window / 86400:.0f}-day windows)",
+        xaxis_title="Forecasts made around",
+        yaxis_title="Calibration error",
+    )
+    fig.update_yaxes(rangemode="tozero")
+
+    return fig
+
+
+def plotly_waterfall(records, max_spans=200):
+    """
+    A timeline of `tracing.Trace.records()`; only the `max_spans` longest spans
+    are drawn.
+    """
+    if len(records) > max_spans:
+        longest = sorted(records, key=lambda r: r["duration"], reverse=True)[:max_spans]
+        records = sorted(longest, key=lambda r: r["start"])
+
+    details = [
+        ", ".join(
+            f"{key}={value}"
+            for key, value in r.items()
+            if key not in ("trace", "id", "parent", "name", "start", "duration")
+        )
+        for r in records
+    ]
+
+    import plotly.graph_objects as go
+
+    fig = go.Figure(
+        go.Bar(
+            y=[f"{r['name']} #{r['id']}" for r in records],
+            x=[1000 * r["duration"] for r in records],
+            base=[1000 * r["start"] for r in records],
+            orientation="h",
+            customdata=details,
+            hovertemplate="%{y}<br>%{x:.1f} ms<br>%{customdata}<extra></extra>",
+        )
+    )
+
+    fig.update_layout(
+        height=max(300, 16 * len(records)),
+        title="Where the time went",
+        xaxis_title="ms since the start of the run",
+        showlegend=False,
+    )
+    fig.update_yaxes(autorange="reversed", showticklabels=len(records) <= 60)
+
+    return fig
@@ -0,0 +1,97 @@
+"""
+Scrapes the resolutions of recently resolved questions of a platform into the
+cache, so that no user request has to wait for them.
+
+    python prefetch_resolutions.py --platform gjo [--curl curl.txt] [--every 3600]
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+import uncurl
+
+from firebase_requests import configure_scraping, get_resolution_index
+from gjo_requests import async_iter_platform_resolved_questions_pages, get_question_resolution
+from scheduler import scheduled_session
+
+PLATFORM_URLS = {
+    "gjo": "https://www.gjopen.com",
+    "cset": "https://www.cset-foretell.com",
+}
+
+
+async def prefetch_resolutions(platform, headers, cookies, stop_at_known=True):
+    """
+    Walks the platform's resolved questions, most recent first, and scrapes the
+    ones missing from the resolution index. With `stop_at_known` it stops at the
+    first page whose questions are all known already.
+    """
+    configure_scraping()
+    platform_url = PLATFORM_URLS[platform]
+    resolution_index = get_resolution_index()
+    loop = asyncio.get_running_loop()
+    n_new = 0
+
+    async with scheduled_session(headers, cookies) as client:
+        pages = async_iter_platform_resolved_questions_pages(platform_url, client)
+        try:
+            async for qs in pages:
+                known = await loop.run_in_executor(None, resolution_index.get, platform, qs)
+                missing = [q for q in qs if q not in known]
+                if not missing and stop_at_known:
+                    break
+
+                results = await asyncio.gather(
+                    *[get_question_resolution(q, platform_url, client) for q in missing],
+                    return_exceptions=True,
+                )
+
+                new_resolutions = dict()
+                for q, result in zip(missing, results):
+                    if isinstance(result, Exception):
+                        logging.error(f"prefetch_resolutions skips qid={q} | {result!r}")
+                    else:
+                        new_resolutions[q] = result
+
+                await loop.run_in_executor(
+                    None, resolution_index.put, platform, new_resolutions
+                )
+                n_new += len(new_resolutions)
+        finally:
+            await pages.aclose()
+
+        logging.info(f"prefetch_resolutions for platform={platform} | {client.stats}")
+
+    return n_new
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    parser.add_argument("--platform", choices=sorted(PLATFORM_URLS), default="gjo")
+    parser.add_argument("--curl", help="a file with a cURL command to take headers and cookies from")
+    parser.add_argument("--all", action="store_true", help="do not stop at the first fully known page")
+    parser.add_argument("--every", type=float, help="repeat every that many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    headers, cookies = dict(), dict()
+    if args.curl:
+        with open(args.curl) as f:
+            curl_content = uncurl.parse_context(f.read().replace("\\", ""))
+        headers, cookies = curl_content.headers, curl_content.cookies
+
+    while True:
+        n_new = asyncio.run(
+            prefetch_resolutions(args.platform, headers, cookies, stop_at_known=not args.all)
+        )
+        logging.info(f"Prefetched {n_new} new resolutions for platform={args.platform}.")
+
+        if args.every is None:
+            break
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
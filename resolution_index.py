@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+
+CLOCK_SKEW = 60  # seconds of slack for the clocks of the processes writing resolutions
+
+
+class ResolutionIndex:
+    """
+    An in-memory map of question resolutions, shared by every session of the
+    process (resolutions are the same for all users).
+
+    A platform's resolutions are loaded from `backend` in full on first use, after
+    which lookups never touch the backend. Once `ttl` seconds have passed the
+    resolutions stored since the last load (e.g. by other processes) are added
+    in a background thread, while lookups keep being served.
+    """
+
+    def __init__(self, backend, ttl=3600):
+        self.backend = backend
+        self.ttl = ttl
+        self._resolutions = dict()  # {platform: {qid: resolution}}
+        self._loaded_at = dict()  # {platform: time.monotonic()}
+        self._loaded_since = dict()  # {platform: time.time() the last load started at}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _load(self, platform):
+        logging.info(f"[ ] ResolutionIndex._load for platform={platform}")
+        started_at = time.time()
+        try:
+            since = self._loaded_since.get(platform)
+            if since is None:
+                loaded = self.backend.get_all_resolutions(platform)
+            else:
+                loaded = self.backend.get_resolutions_since(platform, since - CLOCK_SKEW)
+        finally:
+            with self._lock:
+                self._refreshing.discard(platform)
+
+        with self._lock:
+            # keep what was put while loading
+            resolutions = self._resolutions.setdefault(platform, dict())
+            for q, resolution in loaded.items():
+                resolutions.setdefault(q, resolution)
+            self._loaded_at[platform] = time.monotonic()
+            self._loaded_since[platform] = started_at
+
+        logging.info(f"[X] ResolutionIndex._load for platform={platform}, {len(loaded)} resolutions")
+
+    def _ensure_fresh(self, platform):
+        with self._lock:
+            loaded_at = self._loaded_at.get(platform)
+            stale = loaded_at is not None and time.monotonic() - loaded_at > self.ttl
+            start_refresh = stale and platform not in self._refreshing
+            if start_refresh:
+                self._refreshing.add(platform)
+
+        if loaded_at is None:
+            self._load(platform)
+        elif start_refresh:
+            threading.Thread(target=self._load, args=(platform,), daemon=True).start()
+
+    def get(self, platform, qids):
+        self._ensure_fresh(platform)
+        resolutions = self._resolutions[platform]
+        return {q: resolutions[q] for q in qids if q in resolutions}
+
+    def put(self, platform, resolutions):
+        if not resolutions:
+            return
+        self.backend.put_resolutions(platform, resolutions)
+        with self._lock:
+            self._resolutions.setdefault(platform, dict()).update(resolutions)
+
+    def __len__(self):
+        return sum(len(resolutions) for resolutions in self._resolutions.values())
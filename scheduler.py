@@ -0,0 +1,242 @@
+import asyncio
+import contextlib
+import email.utils
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+
+import tracing
+from http_cache import HTTPCache, conditional_headers
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    def __init__(self, url, status, reason):
+        super().__init__(f"{url} | resp.status == {status} → {reason}")
+        self.url, self.status, self.reason = url, status, reason
+
+
+def _parse_retry_after(value):
+    """
+    Retry-After is either a number of seconds or an HTTP date.
+    """
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _HostLimiter:
+    """
+    AIMD limit on in-flight requests to a single host: grows by about one request
+    per window of fast responses, shrinks on slow responses and halves on
+    throttling. Decreases happen at most once per `cooldown` seconds so that one
+    burst of bad responses is not punished several times.
+    """
+
+    def __init__(self, limit, min_limit, max_limit, cooldown=1.0):
+        self.limit = float(limit)
+        self.min_limit, self.max_limit = min_limit, max_limit
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+        self._last_decrease = float("-inf")
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency, target_latency):
+        if latency <= target_latency:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        else:
+            self._decrease(0.9)
+
+    def on_throttle(self):
+        self._decrease(0.5)
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit * factor)
+            self._last_decrease = now
+
+
+class Scheduler:
+    """
+    Wraps an aiohttp session, built by `make_session` on the first request (so
+    that fully cached runs never open one): every GET goes through a per-host adaptive
+    concurrency limit and is retried with jittered exponential backoff on
+    connection errors, 429 and 5xx responses (honoring Retry-After).
+
+    With an `http_cache` (see http_cache.py) requests for cached URLs are
+    conditional and a 304 response is answered from the cache.
+
+    `stats` counts requests, retries, received bytes, throttled responses,
+    failures and responses not modified since they were cached.
+    """
+
+    def __init__(
+        self,
+        make_session,
+        initial_concurrency=5,
+        min_concurrency=1,
+        max_concurrency=32,
+        target_latency=2.0,
+        max_retries=5,
+        backoff_base=0.5,
+        backoff_cap=30.0,
+        http_cache=None,
+    ):
+        self.make_session = make_session
+        self.session = None
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency, self.max_concurrency = min_concurrency, max_concurrency
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.backoff_base, self.backoff_cap = backoff_base, backoff_cap
+        self.http_cache = http_cache
+
+        self.limiters = dict()  # {host: _HostLimiter}
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "bytes": 0,
+            "throttled": 0,
+            "failures": 0,
+            "not_modified": 0,
+        }
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    def _limiter(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.limiters:
+            self.limiters[host] = _HostLimiter(
+                self.initial_concurrency, self.min_concurrency, self.max_concurrency
+            )
+        return self.limiters[host]
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def get_text(self, url):
+        with tracing.span("http.get", url=url):
+            return await self._get_text(url)
+
+    async def _get_text(self, url):
+        import aiohttp
+
+        if self.session is None:
+            self.session = self.make_session()
+
+        limiter = self._limiter(url)
+        received = 0
+
+        loop = asyncio.get_running_loop()
+        cached = None
+        if self.http_cache is not None:
+            cached = await loop.run_in_executor(None, self.http_cache.lookup, url)
+        headers = conditional_headers(cached)
+
+        for attempt in range(self.max_retries + 1):
+            delay = self._backoff(attempt)
+
+            async with limiter:
+                self.stats["requests"] += 1
+                started = time.monotonic()
+
+                try:
+                    async with self.session.get(url, headers=headers) as resp:
+                        body = await resp.read()
+                        self.stats["bytes"] += len(body)
+                        received += len(body)
+                        tracing.annotate(bytes=received, status=resp.status, attempts=attempt + 1)
+
+                        if resp.status == 304 and cached is not None:
+                            limiter.on_success(time.monotonic() - started, self.target_latency)
+                            self.stats["not_modified"] += 1
+                            tracing.annotate(not_modified=True, bytes_saved=cached.size)
+                            return self.http_cache.not_modified(cached)
+
+                        if resp.status == 200:
+                            limiter.on_success(time.monotonic() - started, self.target_latency)
+                            text = await resp.text()
+                            if self.http_cache is not None:
+                                await loop.run_in_executor(
+                                    None, self.http_cache.store, url, resp.headers, text
+                                )
+                            return text
+
+                        if resp.status not in RETRYABLE_STATUSES:
+                            self.stats["failures"] += 1
+                            raise FetchError(url, resp.status, resp.reason)
+
+                        self.stats["throttled"] += 1
+                        limiter.on_throttle()
+                        retry_after = _parse_retry_after(resp.headers.get("Retry-After"))
+                        if retry_after is not None:
+                            delay = max(delay, retry_after)
+                        error = FetchError(url, resp.status, resp.reason)
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    limiter.on_throttle()
+                    error = e
+
+            if attempt == self.max_retries:
+                break
+
+            logging.warning(f"Scheduler.get_text for url={url} | {error!r}, retrying in {delay:.2f}s")
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+        self.stats["failures"] += 1
+        if isinstance(error, FetchError):
+            raise error
+        # connection errors and timeouts fail a request like an error status does
+        raise FetchError(url, None, repr(error)) from error
+
+
+_http_cache = None  # responses are not cached unless configured
+
+
+def configure_http_cache(path=None):
+    """
+    Makes every `scheduled_session` revalidate its responses against an
+    `HTTPCache` in the SQLite file at `path` (None disables the cache).
+    """
+    global _http_cache
+    _http_cache = None if path is None else HTTPCache(path)
+    return _http_cache
+
+
+@contextlib.asynccontextmanager
+async def scheduled_session(headers, cookies, **kwargs):
+    import aiohttp
+
+    kwargs.setdefault("http_cache", _http_cache)
+    scheduler = Scheduler(
+        lambda: aiohttp.ClientSession(headers=headers, cookies=cookies), **kwargs
+    )
+    try:
+        yield scheduler
+    finally:
+        await scheduler.close()
@@ -0,0 +1,89 @@
+"""
+Coalescing of identical concurrent fetches across the whole process.
+
+Every Streamlit session scrapes on its own event loop in its own thread, so the
+calls in flight are kept as `concurrent.futures.Future`s which any loop can
+await: the first caller of a key (the leader) runs the fetch, callers arriving
+while it runs (followers) await its result instead of fetching again.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+import tracing
+
+
+class _Abandoned(Exception):
+    """
+    The leader was cancelled; its followers have to try again.
+    """
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = dict()  # {key: concurrent.futures.Future}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "followers": 0}
+
+    async def do(self, key, fetch):
+        """
+        Returns the result of `await fetch()`, shared with every concurrent call
+        with the same `key`. The result is shared as is and must not be mutated.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = concurrent.futures.Future()
+                self.stats["leaders" if leader else "followers"] += 1
+
+            if leader:
+                return await self._lead(key, call, fetch)
+
+            tracing.annotate(coalesced=True)
+            try:
+                # shielded: a cancelled follower must not cancel the shared call
+                return await asyncio.shield(asyncio.wrap_future(call))
+            except _Abandoned:
+                continue
+
+    async def _lead(self, key, call, fetch):
+        try:
+            result = await fetch()
+        except Exception as e:
+            call.set_exception(e)
+            raise
+        except BaseException:
+            call.set_exception(_Abandoned())
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+    def __len__(self):
+        return len(self._calls)
+
+
+flights = SingleFlight()
+
+
+def coalesce(key):
+    """
+    Coalesces concurrent calls of the decorated coroutine function which have
+    the same `key(*args, **kwargs)` through the process-wide `flights`.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await flights.do(key(*args, **kwargs), lambda: func(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
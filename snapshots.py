@@ -0,0 +1,400 @@
+"""
+Columnar snapshots of scraped data, for offline analysis, reproducible
+benchmarks and bulk backfills of a cache backend without any scraping.
+
+A snapshot of a platform is a directory
+
+    {root}/{platform}/resolutions.{format}
+    {root}/{platform}/forecasts/uid={uid}/part-0.{format}
+
+of Arrow IPC files (format "arrow": uncompressed, memory-mapped when read) or
+Parquet files (format "parquet": compressed, for archiving and exchange). A
+user's forecasts are stored like the columns of a `ForecastStore`, one row per
+option of a forecast, with dictionary-encoded question ids and timestamps and
+float32 probabilities. The ids of all the user's questions, including those
+without forecasts, are kept in the "qids" field of the schema metadata.
+
+    python snapshots.py export --sqlite gjo_cache.sqlite --uids 28899 --out snapshots
+    python snapshots.py export --dump scraped.json --out snapshots --format parquet
+    python snapshots.py import snapshots --sqlite new_cache.sqlite
+
+pyarrow is needed by this module only.
+"""
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+
+from forecast_store import ForecastStore, parse_timestamps
+
+FORMATS = ["arrow", "parquet"]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Snapshots need pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+
+def _forecasts_schema(pa):
+    return pa.schema(
+        [
+            ("qid", pa.dictionary(pa.int32(), pa.string())),
+            ("forecast", pa.int32()),
+            ("page", pa.int16()),
+            ("timestamp", pa.dictionary(pa.int32(), pa.string())),
+            ("probability", pa.float32()),
+            ("outcome", pa.int8()),
+        ]
+    )
+
+
+def _resolutions_schema(pa):
+    return pa.schema([("qid", pa.dictionary(pa.int32(), pa.string())), ("outcome", pa.int8())])
+
+
+def _forecasts_path(root, platform, uid, fmt):
+    return os.path.join(root, platform, "forecasts", f"uid={uid}", f"part-0.{fmt}")
+
+
+def _resolutions_path(root, platform, fmt):
+    return os.path.join(root, platform, f"resolutions.{fmt}")
+
+
+def _existing(make_path):
+    for fmt in FORMATS:
+        path = make_path(fmt)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _write_table(table, make_path, fmt):
+    """
+    Writes `table` to `make_path(fmt)`, replacing the file in any other format.
+    """
+    pa = _pyarrow()
+
+    path = make_path(fmt)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    if fmt == "arrow":
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, path)
+
+    for other in FORMATS:
+        if other != fmt and os.path.exists(make_path(other)):
+            os.remove(make_path(other))
+
+
+def _read_table(path):
+    """
+    The table of a snapshot file. Arrow files are memory-mapped, so its columns
+    are views of the file.
+    """
+    pa = _pyarrow()
+
+    if path.endswith(".arrow"):
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    else:
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, memory_map=True).unify_dictionaries()
+    return table
+
+
+def _read_columns(path):
+    """
+    {column name: pyarrow array} of a snapshot file.
+    """
+    table = _read_table(path)
+    return {name: table.column(name).combine_chunks() for name in table.column_names}
+
+
+def _read_user(root, platform, uid):
+    """
+    The columns of a user's snapshot and the ids of the user's questions (those
+    with forecasts only, for snapshots written without them).
+    """
+    path = _existing(lambda fmt: _forecasts_path(root, platform, uid, fmt))
+    if path is None:
+        raise FileNotFoundError(f"No snapshot of uid={uid} in {os.path.join(root, platform)}")
+
+    table = _read_table(path)
+    columns = {name: table.column(name).combine_chunks() for name in table.column_names}
+    metadata = table.schema.metadata or dict()
+    if b"qids" in metadata:
+        qids = json.loads(metadata[b"qids"])
+    else:
+        qid = columns["qid"]
+        qids = list(dict.fromkeys(qid.dictionary.take(qid.indices).to_pylist()))
+    return columns, qids
+
+
+def _starts(values):
+    """
+    Offsets at which runs of equal consecutive values start.
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate([[True], values[1:] != values[:-1]]))
+
+
+def _probabilities(column):
+    # float32 keeps 7 significant digits; scraped probabilities are whole
+    # percents, which rounding to 6 decimals restores up to float64 precision.
+    return np.round(column.to_numpy().astype(float), 6)
+
+
+def write_user(root, platform, uid, records, resolutions, fmt="arrow"):
+    """
+    Writes the complete forecast `records` ({qid: {"forecasts": [...], ...}}) of a
+    user. Questions without a resolution in `resolutions` and forecasts whose
+    number of options differs from the resolution's are left out. Returns the
+    number of forecasts written.
+    """
+    pa = _pyarrow()
+
+    columns = {name: [] for name in _forecasts_schema(pa).names}
+    qids, n_forecasts = [], 0
+    for q, record in records.items():
+        resolution = resolutions.get(q)
+        if resolution is None or not record.get("complete", True):
+            continue
+
+        qids.append(q)
+        y_true = resolution["y_true"]
+        for forecast in record["forecasts"]:
+            y_pred = forecast["y_pred"]
+            if not y_pred or len(y_pred) != len(y_true):
+                continue
+
+            columns["qid"].extend([q] * len(y_pred))
+            columns["forecast"].extend([n_forecasts] * len(y_pred))
+            columns["page"].extend([forecast.get("page", 1)] * len(y_pred))
+            columns["timestamp"].extend([forecast["timestamp"]] * len(y_pred))
+            columns["probability"].extend(y_pred)
+            columns["outcome"].extend(y_true)
+            n_forecasts += 1
+
+    schema = _forecasts_schema(pa).with_metadata({"qids": json.dumps(qids)})
+    _write_table(
+        pa.table(columns, schema=schema),
+        lambda fmt: _forecasts_path(root, platform, uid, fmt),
+        fmt,
+    )
+    return n_forecasts
+
+
+def write_resolutions(root, platform, resolutions, fmt="arrow"):
+    """
+    Adds `resolutions` ({qid: {"y_true": [...]}}) to the platform's snapshot.
+    """
+    pa = _pyarrow()
+
+    resolutions = {**read_resolutions(root, platform), **resolutions}
+    qids, outcomes = [], []
+    for q, resolution in resolutions.items():
+        qids.extend([q] * len(resolution["y_true"]))
+        outcomes.extend(resolution["y_true"])
+
+    _write_table(
+        pa.table({"qid": qids, "outcome": outcomes}, schema=_resolutions_schema(pa)),
+        lambda fmt: _resolutions_path(root, platform, fmt),
+        fmt,
+    )
+
+
+def read_resolutions(root, platform):
+    """
+    {qid: {"y_true": (...)}} of the platform's snapshot (empty without one).
+    """
+    path = _existing(lambda fmt: _resolutions_path(root, platform, fmt))
+    if path is None:
+        return dict()
+
+    columns = _read_columns(path)
+    qid, outcome = columns["qid"], columns["outcome"].to_numpy().tolist()
+    indices = qid.indices.to_numpy()
+    dictionary = qid.dictionary.to_pylist()
+
+    starts = _starts(indices)
+    ends = np.append(starts[1:], len(indices))
+    return {
+        dictionary[indices[start]]: {"y_true": tuple(outcome[start:end])}
+        for start, end in zip(starts.tolist(), ends.tolist())
+    }
+
+
+def list_uids(root, platform):
+    directory = os.path.join(root, platform, "forecasts")
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[len("uid=") :] for name in os.listdir(directory) if name.startswith("uid="))
+
+
+def load_store(root, platform, uid):
+    """
+    The `ForecastStore` of a user's snapshot. The offsets are found from the runs
+    of the memory-mapped qid and forecast columns, without building any Python
+    objects per forecast. Questions without forecasts are kept, as in
+    `ForecastStore.from_stream`.
+    """
+    columns, qids = _read_user(root, platform, uid)
+
+    qid_indices = columns["qid"].indices.to_numpy()
+    forecast_starts = _starts(columns["forecast"].to_numpy())
+
+    # the forecasts are written in the order of the user's questions
+    position = {q: i for i, q in enumerate(qids)}
+    dictionary_position = np.array(
+        [position[q] for q in columns["qid"].dictionary.to_pylist()], dtype=np.int64
+    )
+    forecast_question = dictionary_position[qid_indices[forecast_starts]]
+    forecasts_per_question = np.bincount(forecast_question, minlength=len(qids))
+
+    timestamp = columns["timestamp"]
+    timestamp_indices = timestamp.indices.to_numpy()[forecast_starts]
+
+    return ForecastStore(
+        qids,
+        np.concatenate([[0], np.cumsum(forecasts_per_question)]),
+        np.append(forecast_starts, len(qid_indices)),
+        _probabilities(columns["probability"]),
+        columns["outcome"].to_numpy(),
+        parse_timestamps(timestamp.dictionary.to_pylist())[timestamp_indices],
+    )
+
+
+def read_user_records(root, platform, uid):
+    """
+    The forecast records ({qid: {"forecasts": [...], "last_page": ..., "complete":
+    True}}) of a user's snapshot, as stored by the cache backends.
+    """
+    columns, qids = _read_user(root, platform, uid)
+
+    qid, timestamp = columns["qid"], columns["timestamp"]
+    qid_dictionary, timestamp_dictionary = qid.dictionary.to_pylist(), timestamp.dictionary.to_pylist()
+    qid_indices, timestamp_indices = qid.indices.to_numpy(), timestamp.indices.to_numpy()
+    page = columns["page"].to_numpy()
+    probability = _probabilities(columns["probability"]).tolist()
+
+    starts = _starts(columns["forecast"].to_numpy())
+    ends = np.append(starts[1:], len(qid_indices))
+
+    records = {q: {"forecasts": [], "last_page": 0, "complete": True} for q in qids}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        record = records[qid_dictionary[qid_indices[start]]]
+        record["forecasts"].append(
+            {
+                "y_pred": tuple(probability[start:end]),
+                "timestamp": timestamp_dictionary[timestamp_indices[start]],
+                "page": int(page[start]),
+            }
+        )
+        record["last_page"] = max(record["last_page"], int(page[start]))
+    return records
+
+
+def dataset(root, platform, fmt="arrow"):
+    """
+    The forecasts of every user of the platform as one `pyarrow.dataset.Dataset`
+    with a `uid` partition column, e.g. for filtered scans across users.
+    """
+    pa = _pyarrow()
+    import pyarrow.dataset as ds
+
+    return ds.dataset(
+        os.path.join(root, platform, "forecasts"),
+        format="ipc" if fmt == "arrow" else "parquet",
+        partitioning=ds.partitioning(pa.schema([("uid", pa.string())]), flavor="hive"),
+    )
+
+
+def export_user_data(users_data, root, platform, fmt="arrow"):
+    """
+    Writes {uid: [(qid, forecasts, resolution), ...]}, the format of batch.py's
+    dumps and of `gjo_requests.stream_user_data`.
+    """
+    resolutions = {q: r for user_data in users_data.values() for q, _, r in user_data}
+    write_resolutions(root, platform, resolutions, fmt)
+    for uid, user_data in users_data.items():
+        records = {q: {"forecasts": forecasts} for q, forecasts, _ in user_data}
+        write_user(root, platform, uid, records, resolutions, fmt)
+
+
+def export_backend(backend, root, platform, uids, fmt="arrow"):
+    """
+    Writes the platform's resolutions and the forecasts of `uids` from a cache
+    backend (see cache_backends.py), looked up among the resolved questions.
+    """
+    resolutions = backend.get_all_resolutions(platform)
+    write_resolutions(root, platform, resolutions, fmt)
+    for uid in uids:
+        records = backend.get_forecasts(platform, uid, list(resolutions))
+        n_forecasts = write_user(root, platform, uid, records, resolutions, fmt)
+        logging.info(f"export_backend for uid={uid} | {len(records)} questions, {n_forecasts} forecasts")
+
+
+def import_into_backend(backend, root, platform, uids=None):
+    """
+    Backfills a cache backend with the snapshot's resolutions and the forecasts of
+    `uids` (every user of the snapshot by default).
+    """
+    backend.put_resolutions(platform, read_resolutions(root, platform))
+    for uid in list_uids(root, platform) if uids is None else uids:
+        backend.put_forecasts(platform, uid, read_user_records(root, platform, uid))
+
+
+def main():
+    from cache_backends import SQLiteBackend
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export = subparsers.add_parser("export", help="write a snapshot")
+    source = export.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sqlite", help="a SQLite cache to export (see cache_backends.py)")
+    source.add_argument("--dump", help="a JSON dump of batch.py")
+    export.add_argument("--uids", nargs="+", help="users to export from --sqlite")
+    export.add_argument("--out", default="snapshots")
+    export.add_argument("--format", choices=FORMATS, default="arrow")
+
+    backfill = subparsers.add_parser("import", help="backfill a SQLite cache from a snapshot")
+    backfill.add_argument("root")
+    backfill.add_argument("--sqlite", required=True)
+    backfill.add_argument("--uids", nargs="+", help="users to import (default: all)")
+
+    for subparser in (export, backfill):
+        subparser.add_argument("--platform", choices=["gjo", "cset"], default="gjo")
+
+    args = parser.parse_args()
+    try:
+        _pyarrow()
+    except ImportError as e:
+        parser.error(str(e))
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "export" and args.dump:
+        with open(args.dump) as f:
+            users_data = {uid: [tuple(item) for item in data] for uid, data in json.load(f).items()}
+        export_user_data(users_data, args.out, args.platform, args.format)
+    elif args.command == "export":
+        if not args.uids:
+            parser.error("--sqlite needs --uids")
+        export_backend(SQLiteBackend(args.sqlite), args.out, args.platform, args.uids, args.format)
+    else:
+        import_into_backend(SQLiteBackend(args.sqlite), args.root, args.platform, args.uids)
+
+
+if __name__ == "__main__":
+    main()
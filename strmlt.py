@@ -2,12 +2,18 @@ import logging
 import numpy as np
 import pandas as pd
 import sys
+import time
+from datetime import datetime, timedelta, timezone
 import streamlit as st
 import uncurl
-from calibration import overconfidence
-from firebase_requests import get_forecasts, get_resolutions
-from gjo_requests import get_resolved_questions
-from plotting import plotly_calibration, plotly_calibration_odds
+import tracing
+from calibration import CalibrationAccumulator, overconfidence
+from derived import binary_data, calibration_figure, calibration_odds_figure, calibration_over_time_figure
+from firebase_requests import iter_user_data, store_cache
+from forecast_store import ForecastStoreBuilder
+from metrics import scores, scores_by_group
+from plotting import plotly_calibration, plotly_waterfall
+from scheduler import FetchError
 
 
 if __name__ == "__main__":
@@ -48,6 +54,8 @@ if __name__ == "__main__":
     #     - If you hover over a datapoint you can see precise coordinates (x, y) and number of samples (N) contributing to it.
     # """)
 
+    show_timings = st.sidebar.checkbox("Show where the time went (debug)")
+
     st.sidebar.subheader("Authorship and acknowledgments")
 
     st.sidebar.write("This web app was built by [Misha Yagudin](https://twitter.com/mishayagudin). I am grateful to [Nuño Sempere](https://nunosempere.github.io/) for providing feedback.")
@@ -101,44 +109,97 @@ if __name__ == "__main__":
 
     # ---
 
-    with st.spinner('Loading resolved questions...'):
-        questions = get_resolved_questions(uid, platform_url, headers, cookies)
-
-    st.write(f"- {len(questions)} questions you forecasted on have resolved.")
-
-    # ---
-    # TODO: Make a progress bar..?
-
-    with st.spinner('Loading your forecasts...'):
-        forecasts = get_forecasts(uid, questions, platform_url, headers, cookies)
-    
-    with st.spinner("Loading questions's resolutions..."):
-        resolutions = get_resolutions(questions, platform_url, headers, cookies)
+    trace = tracing.begin(f"uid={uid}")
+
+    # Widget reruns reuse the store built on the first run instead of replaying
+    # the cached user data through the builder (unless some questions failed to
+    # load, which the next run retries).
+    with tracing.span("store.cache"):
+        store = store_cache.get((platform_url, uid))
+        tracing.annotate(cache_hit=store is not None)
+
+    if store is None:
+        builder = ForecastStoreBuilder()
+
+        # While loading, a calibration plot of what has arrived so far is redrawn
+        # at most every PREVIEW_INTERVAL seconds.
+        PREVIEW_INTERVAL = 1.0
+        preview = CalibrationAccumulator(n_bins=20 + 1)
+        previewed_at = -PREVIEW_INTERVAL
+
+        progress = dict()
+        progress_text, progress_bar, preview_chart = st.empty(), st.progress(0), st.empty()
+        progress_text.text("Loading your forecasts and questions's resolutions...")
+
+        try:
+            with tracing.span("load"):
+                for q, q_forecasts, q_resolution in iter_user_data(
+                    uid, platform_url, headers, cookies, progress=progress
+                ):
+                    n_forecasts = builder.n_forecasts
+                    builder.add_question(q, q_forecasts, q_resolution)
+                    preview.add(*builder.binary_since(n_forecasts))
+
+                    found, done = progress.get("found", 0), len(builder.qids)
+                    listed = progress.get("listed", False)
+                    progress_text.text(
+                        f"Loaded {done} of {found}{'' if listed else '+'} questions you forecasted on..."
+                    )
+                    progress_bar.progress(min(100, int(100 * done / max(found, 1))))
+
+                    replayed = listed and progress.get("done") == found  # from the cache, no need to preview
+                    if len(preview) and not replayed and time.monotonic() - previewed_at > PREVIEW_INTERVAL:
+                        fig = plotly_calibration(None, None, n_bins=preview.n_bins, strategy="uniform", engine=preview)
+                        preview_chart.plotly_chart(fig, use_container_width=True)
+                        previewed_at = time.monotonic()
+        except FetchError as e:
+            logging.error(f"strmlt | {e}")
+            progress_text.empty()
+            progress_bar.empty()
+            preview_chart.empty()
+            st.warning("I couldn't load your forecasts: please check your user ID and try copying your cURL again (see the sidebar for the instructions).")
+            st.stop()
+
+        progress_text.empty()
+        progress_bar.empty()
+        preview_chart.empty()
+
+        with tracing.span("store.build"):
+            store = builder.build()
+
+        if not progress.get("failed"):
+            store_cache.put((platform_url, uid), store)
+
+    st.write(f"- {store.n_questions} questions you forecasted on have resolved.")
 
     # ---
 
-    num_forecasts = sum(len(f) for f in forecasts.values())
     st.write(
-        f"- You've made {num_forecasts} forecasts on these {len(questions)} questions."
+        f"- You've made {store.n_forecasts} forecasts on these {store.n_questions} questions."
     )
 
-    flatten = lambda t: [item for sublist in t for item in sublist]
-    # y_true = flatten(resolutions[q]["y_true"] for q in questions for _ in forecasts[q])
-    # y_pred = flatten(f["y_pred"] for q in questions for f in forecasts[q])
+    brier_scores, log_scores = store.brier_scores(), store.log_scores()
+    if len(brier_scores):
+        st.write(
+            f"- Your mean Brier score is {brier_scores.mean():.3f} and "
+            f"your mean log score is {log_scores.mean():.3f} (lower is better)."
+        )
 
-    # Note that I am "double counting" each prediction.
-    # if st.checkbox("Drop last"):
-    y_true = flatten(
-        resolutions[q]["y_true"][:-1] for q in questions for _ in forecasts[q]
+    view_select = st.selectbox(
+        "How should I count questions with several options?",
+        [
+            "Every option but the last one of each forecast",
+            "Only the most likely option of each forecast",
+        ],
     )
-    y_pred = flatten(f["y_pred"][:-1] for q in questions for f in forecasts[q])
-
-    y_true, y_pred = np.array(y_true), np.array(y_pred)
-
-    order = np.arange(len(y_true))
-    np.random.default_rng(0).shuffle(order)
-    y_true, y_pred = y_true[order], y_pred[order]
+    view = {
+        "Every option but the last one of each forecast": "drop_last",
+        "Only the most likely option of each forecast": "top_label",
+    }[view_select]
 
+    # The arrays, sorted engines and figures below are computed once per dataset
+    # and parameters, widget reruns reuse them.
+    y_true, y_pred, groups, _, _, _ = binary_data(store, view)
 
     st.write(f"- Which gives us {len(y_pred)} datapoints to work with.")
 
@@ -163,17 +224,122 @@ if __name__ == "__main__":
         value=recommended_n_bins,
     )
 
+    errors_select = st.selectbox(
+        "Which error bars do you want to see?",
+        [
+            "One standard deviation",
+            "Wilson score interval",
+            "Bootstrap over questions",
+        ],
+    )
+    errors = {
+        "One standard deviation": "std",
+        "Wilson score interval": "wilson",
+        "Bootstrap over questions": "bootstrap",
+    }[errors_select]
+
+    DAY = 24 * 60 * 60
+    start, end, half_life = None, None, None
+
+    timestamps = store.binary_by_time(view)[0]
+    if len(timestamps):
+        first_day = datetime.fromtimestamp(timestamps[0], timezone.utc).date()
+        last_day = datetime.fromtimestamp(timestamps[-1], timezone.utc).date()
+
+        if first_day < last_day:
+            days = st.slider(
+                "Which forecasts do you want to look at?",
+                min_value=first_day,
+                max_value=last_day,
+                value=(first_day, last_day),
+                format="YYYY-MM-DD",
+            )
+            if days != (first_day, last_day):
+                start, end = [
+                    datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+                    for day in (days[0], days[1] + timedelta(days=1))
+                ]
+
+        half_life_select = st.selectbox(
+            "Should recent forecasts count more?",
+            [
+                "Count all forecasts equally",
+                "A month-old forecast counts half as much",
+                "A quarter-old forecast counts half as much",
+                "A year-old forecast counts half as much",
+            ],
+        )
+        half_life = {
+            "Count all forecasts equally": None,
+            "A month-old forecast counts half as much": 30 * DAY,
+            "A quarter-old forecast counts half as much": 91 * DAY,
+            "A year-old forecast counts half as much": 365 * DAY,
+        }[half_life_select]
+
     # ---
    
+    if start is not None and len(binary_data(store, view, start, end)[1]) == 0:
+        st.warning("You haven't made any forecasts in these dates.")
+        st.stop()
+
     try:
-        fig = plotly_calibration(y_true, y_pred, n_bins=n_bins, strategy=strategy)
+        fig = calibration_figure(store, n_bins, strategy, errors, view, start, end, half_life)
         st.plotly_chart(fig, use_container_width=True)
 
-        fig = plotly_calibration_odds(y_true, y_pred, n_bins=n_bins, strategy=strategy)
+        fig = calibration_odds_figure(store, n_bins, strategy, errors, view, start, end, half_life)
         st.plotly_chart(fig, use_container_width=True)
+
+        if len(timestamps):
+            fig = calibration_over_time_figure(store, window=91 * DAY, view=view)
+            st.plotly_chart(fig, use_container_width=True)
     except Exception as e:
         st.warning("Hey! Unfortunately, a very mysterious error occured. Try refreshing the page or changing the number of bins a bit.")
 
+    y_true, y_pred, groups, sample_weight, _, _ = binary_data(store, view, start, end, half_life)
+    metric_values = scores(
+        y_true, y_pred, n_bins=n_bins, strategy=strategy, sample_weight=sample_weight
+    )
+    _, _, question_brier, question_log = scores_by_group(
+        y_true, y_pred, groups, sample_weight=sample_weight
+    )
+
+    st.table(
+        pd.DataFrame(
+            {
+                "": [
+                    metric_values["brier"],
+                    question_brier.mean(),
+                    metric_values["log"],
+                    question_log.mean(),
+                    metric_values["reliability"],
+                    metric_values["resolution"],
+                    metric_values["uncertainty"],
+                    metric_values["ece"],
+                    metric_values["mce"],
+                    metric_values["overconfidence"],
+                ]
+            },
+            index=[
+                "Brier score",
+                "Brier score, averaged over questions",
+                "Log score",
+                "Log score, averaged over questions",
+                "Reliability (lower is better)",
+                "Resolution (higher is better)",
+                "Uncertainty",
+                "Expected calibration error",
+                "Maximal calibration error",
+                "Over/under- confidence",
+            ],
+        ).round(3)
+    )
+
+    trace.log()
+
+    if show_timings:
+        st.plotly_chart(plotly_waterfall(trace.records()), use_container_width=True)
+        st.code(trace.to_openmetrics())
+
 
     # for strategy in ['uniform', 'quantile']:
     #     for n_bins in range(30, 300, 10):
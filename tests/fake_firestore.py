@@ -0,0 +1,118 @@
+"""
+An in-memory stand-in for the subset of `google.cloud.firestore.Client` used by
+cache_backends.FirestoreBackend, for testing it without Firestore credentials.
+"""
+import copy
+import operator
+import uuid
+
+_OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    ">=": operator.ge,
+    ">": operator.gt,
+}
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self):
+        return DocumentSnapshot(self, self._client._documents.get(self.path))
+
+    def set(self, data, merge=False):
+        if merge and self.path in self._client._documents:
+            self.update(data)
+        else:
+            self._client._documents[self.path] = copy.deepcopy(dict(data))
+
+    def update(self, data):
+        if self.path not in self._client._documents:
+            raise KeyError(f"No document to update: {self.path}")
+        self._client._documents[self.path].update(copy.deepcopy(dict(data)))
+
+
+class CollectionReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = uuid.uuid4().hex
+        return DocumentReference(self._client, f"{self.path}/{document_id}")
+
+    def add(self, data, document_id):
+        reference = self.document(document_id)
+        reference.set(data)
+        return None, reference
+
+    def stream(self):
+        prefix = f"{self.path}/"
+        for path in list(self._client._documents):
+            if path.startswith(prefix) and "/" not in path[len(prefix):]:
+                yield DocumentReference(self._client, path).get()
+
+    def where(self, field, op, value):
+        return Query(self, field, _OPERATORS[op], value)
+
+
+class Query:
+    def __init__(self, collection, field, compare, value):
+        self._collection = collection
+        self._field, self._compare, self._value = field, compare, value
+
+    def stream(self):
+        for snapshot in self._collection.stream():
+            data = snapshot.to_dict()
+            if self._field in data and self._compare(data[self._field], self._value):
+                yield snapshot
+
+
+class WriteBatch:
+    def __init__(self):
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((lambda data: reference.set(data, merge=merge), data))
+
+    def update(self, reference, data):
+        self._writes.append((reference.update, data))
+
+    def commit(self):
+        for write, data in self._writes:
+            write(data)
+        self._writes = []
+
+
+class Client:
+    def __init__(self):
+        self._documents = dict()  # {path: data}
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def get_all(self, references):
+        for reference in references:
+            yield reference.get()
+
+    def batch(self):
+        return WriteBatch()
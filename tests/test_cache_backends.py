@@ -0,0 +1,125 @@
+import fake_firestore
+from cache_backends import (
+    BATCH_SIZE,
+    CoalescingBackend,
+    FirestoreBackend,
+    MemoryLRUBackend,
+    SQLiteBackend,
+    TieredBackend,
+)
+
+
+class CountingClient(fake_firestore.Client):
+    def __init__(self):
+        super().__init__()
+        self.n_batches = 0
+        self.n_reads = 0
+
+    def batch(self):
+        self.n_batches += 1
+        return super().batch()
+
+    def get_all(self, references):
+        self.n_reads += 1
+        return super().get_all(references)
+
+
+def record(n_forecasts, complete=True):
+    forecasts = [{"y_pred": [0.3, 0.7], "timestamp": f"t{i}", "page": 1} for i in range(n_forecasts)]
+    return {"forecasts": forecasts, "last_page": 1, "complete": complete}
+
+
+def test_firestore_stores_one_document_per_question():
+    client = CountingClient()
+    backend = FirestoreBackend(lambda: client)
+
+    backend.put_forecasts("gjo", "7", {"1": record(2), "2": record(3, complete=False)})
+
+    assert sorted(client._documents) == ["users_gjo/7/forecasts/1", "users_gjo/7/forecasts/2"]
+    assert backend.get_forecasts("gjo", "7", ["1", "2", "3"]) == {"1": record(2), "2": record(3, False)}
+    assert client.n_reads == 1
+
+
+def test_firestore_writes_in_batches():
+    client = CountingClient()
+    backend = FirestoreBackend(lambda: client)
+
+    backend.put_forecasts("gjo", "7", {str(q): record(1) for q in range(BATCH_SIZE + 1)})
+
+    assert client.n_batches == 2
+    assert len(backend.get_forecasts("gjo", "7", [str(q) for q in range(BATCH_SIZE + 1)])) == BATCH_SIZE + 1
+
+
+def test_firestore_merges_resolutions():
+    backend = FirestoreBackend(fake_firestore.Client)
+
+    backend.put_resolutions("gjo", {"1": {"y_true": [1, 0]}})
+    backend.put_resolutions("gjo", {"2": {"y_true": [0, 1]}})
+
+    assert backend.get_all_resolutions("gjo") == {"1": {"y_true": [1, 0]}, "2": {"y_true": [0, 1]}}
+    assert backend.get_resolutions("gjo", ["2", "3"]) == {"2": {"y_true": [0, 1]}}
+
+
+def test_coalescing_backend_merges_writes_into_one_flush():
+    client = CountingClient()
+    backend = CoalescingBackend(FirestoreBackend(lambda: client), delay=60)
+
+    for q in range(10):
+        backend.put_forecasts("gjo", "7", {str(q): record(1)})
+        backend.put_resolutions("gjo", {str(q): {"y_true": [1, 0]}})
+
+    # pending writes are visible, nothing is written yet
+    assert len(backend.get_forecasts("gjo", "7", [str(q) for q in range(10)])) == 10
+    assert len(backend.get_all_resolutions("gjo")) == 10
+    assert client._documents == {}
+
+    backend.flush()
+
+    assert client.n_batches == 2  # the forecasts of the user, the resolutions
+    assert backend.stats == {"writes": 20, "flushes": 1}
+    assert len(client._documents) == 10 + 2  # the forecasts, the resolutions map and its update
+
+
+def test_coalescing_backend_flushes_after_delay():
+    client = fake_firestore.Client()
+    backend = CoalescingBackend(FirestoreBackend(lambda: client), delay=0.01)
+
+    backend.put_forecasts("gjo", "7", {"1": record(1)})
+    backend._timer.join()
+
+    assert "users_gjo/7/forecasts/1" in client._documents
+
+
+def test_tiered_backend_reads_through_and_backfills(tmp_path):
+    memory, sqlite = MemoryLRUBackend(), SQLiteBackend(str(tmp_path / "cache.sqlite"))
+    firestore = FirestoreBackend(fake_firestore.Client)
+    firestore.put_forecasts("gjo", "7", {"1": record(1)})
+    sqlite.put_forecasts("gjo", "7", {"2": record(2)})
+
+    backend = TieredBackend([memory, sqlite, firestore])
+
+    assert backend.get_forecasts("gjo", "7", ["1", "2", "3"]) == {"1": record(1), "2": record(2)}
+    assert memory.get_forecasts("gjo", "7", ["1", "2"]) == {"1": record(1), "2": record(2)}
+    assert sqlite.get_forecasts("gjo", "7", ["1"]) == {"1": record(1)}
+
+
+def test_question_lists_in_every_backend(tmp_path):
+    client = fake_firestore.Client()
+    client._documents["users_gjo/7"] = {"1": []}  # the legacy {qid: forecasts} map
+    firestore = FirestoreBackend(lambda: client)
+    firestore.put_forecasts("gjo", "7", {"1": record(1)})
+    memory, sqlite = MemoryLRUBackend(), SQLiteBackend(str(tmp_path / "cache.sqlite"))
+    coalescing = CoalescingBackend(firestore, delay=60)
+    backend = TieredBackend([memory, sqlite, coalescing])
+
+    assert backend.get_questions("gjo", "7") is None
+
+    coalescing.put_questions("gjo", "7", ["2", "1"])
+    assert firestore.get_questions("gjo", "7") is None
+    coalescing.flush()
+
+    assert firestore.get_questions("gjo", "7") == ["2", "1"]
+    assert client._documents["users_gjo/7"] == {"1": []}
+    assert firestore.get_forecasts("gjo", "7", ["1"]) == {"1": record(1)}
+    assert backend.get_questions("gjo", "7") == ["2", "1"]
+    assert memory.get_questions("gjo", "7") == sqlite.get_questions("gjo", "7") == ["2", "1"]
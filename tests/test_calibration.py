@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from calibration import CalibrationEngine, calibration_curve
+
+
+@pytest.mark.parametrize("strategy", ["uniform", "quantile"])
+def test_engine_matches_calibration_curve_on_tied_probabilities(strategy):
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        n = rng.integers(1, 400)
+        # whole percents, mostly a few popular values, as scraped forecasts are
+        y_prob = rng.choice([1, 5, 10, 25, 50, 75, 90, 95, 99, *range(101)], size=n) / 100
+        y_true = (rng.random(n) < y_prob).astype(float)
+        weight = None if rng.random() < 0.5 else rng.random(n)
+        n_bins = int(rng.integers(1, 40))
+
+        expected = calibration_curve(
+            y_true, y_prob, n_bins=n_bins, strategy=strategy, sample_weight=weight
+        )
+        engine = CalibrationEngine(y_true, y_prob, weight)
+        for actual in [engine.curve(n_bins, strategy), engine.curves([n_bins], strategy)[0]]:
+            for a, e in zip(actual, expected):
+                assert len(a) == len(e)
+                assert np.allclose(a, e, rtol=1e-9, atol=1e-12)
@@ -0,0 +1,41 @@
+import time
+
+from http_cache import HTTPCache, conditional_headers
+
+
+def test_stores_only_responses_with_validators(tmp_path):
+    cache = HTTPCache(str(tmp_path / "http.sqlite"))
+
+    assert not cache.store("u0", {}, "body")
+    assert cache.store("u1", {"ETag": '"1"'}, "body")
+
+    cached = cache.lookup("u1")
+    assert conditional_headers(cached) == {"If-None-Match": '"1"'}
+    assert cache.not_modified(cached) == "body"
+    assert cache.lookup("u0") is None
+    assert cache.stats["bytes_saved"] == 4
+
+
+def test_evicts_the_oldest_entries_beyond_max_entries(tmp_path):
+    cache = HTTPCache(str(tmp_path / "http.sqlite"), max_entries=3)
+    for i in range(5):
+        cache.store(f"u{i}", {"ETag": f'"{i}"'}, "body")
+
+    cache.evict()
+
+    assert len(cache) == 3
+    assert cache.lookup("u0") is None and cache.lookup("u1") is None
+    assert cache.lookup("u4") is not None
+    assert cache.stats["evictions"] == 2
+
+
+def test_expired_entries_are_not_revalidated(tmp_path):
+    cache = HTTPCache(str(tmp_path / "http.sqlite"), max_age=0.05)
+    cache.store("u", {"Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, "body")
+    assert cache.lookup("u") is not None
+
+    time.sleep(0.1)
+
+    assert cache.lookup("u") is None
+    cache.evict()
+    assert len(cache) == 0
@@ -0,0 +1,88 @@
+import asyncio
+
+from aiohttp import web
+
+from benchmarks.mock_server import MockGJO
+from gjo_requests import IncompleteForecasts, async_stream_user_data, get_forecasts_on_the_question
+from scheduler import scheduled_session
+
+
+class FlakyMockGJO(MockGJO):
+    """
+    Answers the forecast pages in `failing` ({(qid, page), ...}) with 404.
+    """
+
+    def __init__(self, failing, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = failing
+
+    async def prediction_sets(self, request):
+        if (request.match_info["qid"], int(request.query.get("page", 1))) in self.failing:
+            self.n_requests += 1
+            raise web.HTTPNotFound()
+        return await super().prediction_sets(request)
+
+
+def test_resumes_forecasts_from_the_last_page():
+    async def main():
+        async with FlakyMockGJO({("1000", 3)}, n_questions=1, forecast_pages=3) as mock:
+            async with scheduled_session({}, {}) as client:
+                try:
+                    await get_forecasts_on_the_question("1", "1000", mock.url, client)
+                except IncompleteForecasts as e:
+                    incomplete = e.forecasts
+
+                mock.failing.clear()
+                full = await get_forecasts_on_the_question("1", "1000", mock.url, client)
+
+                n_requests = mock.n_requests
+                known = {"forecasts": incomplete, "last_page": 2, "complete": False}
+                resumed = await get_forecasts_on_the_question(
+                    "1", "1000", mock.url, client, known=known
+                )
+                return incomplete, full, resumed, mock.n_requests - n_requests
+
+    incomplete, full, resumed, n_requests = asyncio.run(main())
+    assert {f["page"] for f in incomplete} == {1, 2}
+    assert resumed == full
+    assert n_requests == 3  # pages 2, 3 and the empty page 4
+
+
+def test_stream_stores_incomplete_forecasts():
+    stored = dict()
+
+    async def main():
+        async with FlakyMockGJO({("1001", 2)}, n_questions=4, forecast_pages=2) as mock:
+            return [
+                q
+                async for q, _, _ in async_stream_user_data(
+                    "1", mock.url, {}, {}, store_incomplete=stored.__setitem__
+                )
+            ]
+
+    qids = asyncio.run(main())
+    assert sorted(qids) == ["1000", "1002", "1003"]
+    assert list(stored) == ["1001"]
+    assert {f["page"] for f in stored["1001"]} == {1}
+
+
+def test_stream_lists_only_the_new_scores_pages_of_known_users():
+    looked_up = []
+
+    def lookup_forecasts(qs):
+        looked_up.append(list(qs))
+        return {q: {"forecasts": [], "last_page": 1, "complete": True} for q in qs if q != "1000"}
+
+    async def main():
+        async with MockGJO(n_questions=6, questions_per_page=2) as mock:
+            known = mock.qids[2:]  # the first page resolved since the last visit
+            return [
+                q
+                async for q, _, _ in async_stream_user_data(
+                    "1", mock.url, {}, {}, lookup_forecasts=lookup_forecasts, known=known
+                )
+            ]
+
+    qids = asyncio.run(main())
+    assert sorted(qids) == ["1000", "1001", "1002", "1003", "1004", "1005"]
+    assert looked_up == [["1000", "1001"], ["1002", "1003", "1004", "1005"]]
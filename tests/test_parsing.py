@@ -0,0 +1,16 @@
+from benchmarks import fixtures
+from benchmarks.bench_parsing import check_equivalence, reference_extract_forecasts_from_page
+from gjo_requests import _extract_forecasts_from_page
+
+
+def test_single_pass_parser_matches_beautifulsoup():
+    check_equivalence()
+
+
+def test_tag_names_are_case_insensitive():
+    page = fixtures.forecast_page(5, n_options=3, seed=7)
+    page = page.replace("<div", "<DIV").replace("</div>", "</DIV>")
+
+    forecasts = _extract_forecasts_from_page(page)
+    assert len(forecasts) == 5
+    assert forecasts == reference_extract_forecasts_from_page(page)
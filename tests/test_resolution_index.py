@@ -0,0 +1,50 @@
+import fake_firestore
+from cache_backends import FirestoreBackend, MemoryLRUBackend, SQLiteBackend, TieredBackend
+from resolution_index import ResolutionIndex
+
+
+class CountingFirestoreBackend(FirestoreBackend):
+    def __init__(self):
+        client = fake_firestore.Client()
+        super().__init__(lambda: client)
+        self.calls = []
+
+    def get_all_resolutions(self, platform):
+        self.calls.append("all")
+        return super().get_all_resolutions(platform)
+
+    def get_resolutions_since(self, platform, since):
+        self.calls.append("since")
+        return super().get_resolutions_since(platform, since)
+
+
+def test_refresh_reads_only_the_resolutions_stored_since_the_last_load(tmp_path):
+    firestore = CountingFirestoreBackend()
+    firestore.put_resolutions("gjo", {"1": {"y_true": [1, 0]}})
+    sqlite = SQLiteBackend(str(tmp_path / "cache.sqlite"))
+    memory = MemoryLRUBackend()
+    index = ResolutionIndex(TieredBackend([memory, sqlite, firestore]))
+
+    assert index.get("gjo", ["1"]) == {"1": {"y_true": [1, 0]}}
+    assert sqlite.get_all_resolutions("gjo") == {"1": {"y_true": [1, 0]}}
+    assert memory.get_all_resolutions("gjo") == dict()  # the index keeps them already
+
+    # another process stores a resolution
+    firestore.put_resolutions("gjo", {"2": {"y_true": [0, 1]}})
+    index._load("gjo")
+
+    assert firestore.calls == ["all", "since"]
+    assert index.get("gjo", ["1", "2"]) == {"1": {"y_true": [1, 0]}, "2": {"y_true": [0, 1]}}
+    assert sqlite.get_all_resolutions("gjo") == {"1": {"y_true": [1, 0]}, "2": {"y_true": [0, 1]}}
+
+
+def test_backends_list_resolutions_by_time(tmp_path):
+    for backend in [
+        MemoryLRUBackend(),
+        SQLiteBackend(str(tmp_path / "cache.sqlite")),
+        FirestoreBackend(fake_firestore.Client),
+    ]:
+        backend.put_resolutions("gjo", {"1": {"y_true": [1, 0]}})
+        assert backend.get_resolutions_since("gjo", 0) == {"1": {"y_true": [1, 0]}}
+        assert backend.get_resolutions_since("gjo", float("inf")) == dict()
+        assert backend.get_resolutions_since("cset", 0) == dict()
@@ -0,0 +1,169 @@
+import asyncio
+import contextlib
+import socket
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from scheduler import FetchError, Scheduler, _HostLimiter, _parse_retry_after
+
+
+@contextlib.asynccontextmanager
+async def stub_server(responses):
+    """
+    Serves `responses`, a list of (status, headers) answered in turn to every
+    GET (the last one repeats); yields the url and the list of request times.
+    """
+    requests = []
+
+    async def handle(request):
+        requests.append(time.monotonic())
+        status, headers = responses[min(len(requests), len(responses)) - 1]
+        return web.Response(status=status, text="ok" if status == 200 else "", headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        yield f"http://127.0.0.1:{runner.addresses[0][1]}/", requests
+    finally:
+        await runner.cleanup()
+
+
+def fetch(url, **kwargs):
+    async def main():
+        scheduler = Scheduler(aiohttp.ClientSession, backoff_base=0.01, **kwargs)
+        try:
+            return await scheduler.get_text(url), scheduler.stats
+        finally:
+            await scheduler.close()
+
+    return asyncio.run(main())
+
+
+def test_retries_throttled_and_failing_responses():
+    async def main():
+        async with stub_server([(429, {}), (503, {}), (200, {})]) as (url, requests):
+            scheduler = Scheduler(aiohttp.ClientSession, backoff_base=0.01)
+            try:
+                text = await scheduler.get_text(url)
+            finally:
+                await scheduler.close()
+            return text, scheduler.stats, len(requests)
+
+    text, stats, n_requests = asyncio.run(main())
+    assert text == "ok"
+    assert n_requests == 3
+    assert stats["retries"] == 2 and stats["throttled"] == 2 and stats["failures"] == 0
+
+
+def test_honors_retry_after():
+    async def main():
+        async with stub_server([(503, {"Retry-After": "0.3"}), (200, {})]) as (url, requests):
+            scheduler = Scheduler(aiohttp.ClientSession, backoff_base=0.01)
+            try:
+                await scheduler.get_text(url)
+            finally:
+                await scheduler.close()
+            return requests
+
+    requests = asyncio.run(main())
+    assert requests[1] - requests[0] >= 0.3
+
+
+def test_gives_up_after_max_retries():
+    async def main():
+        async with stub_server([(503, {})]) as (url, requests):
+            scheduler = Scheduler(aiohttp.ClientSession, backoff_base=0.01, max_retries=2)
+            try:
+                with pytest.raises(FetchError) as error:
+                    await scheduler.get_text(url)
+            finally:
+                await scheduler.close()
+            return error.value, len(requests)
+
+    error, n_requests = asyncio.run(main())
+    assert error.status == 503
+    assert n_requests == 3
+
+
+def test_does_not_retry_client_errors():
+    async def main():
+        async with stub_server([(404, {})]) as (url, requests):
+            scheduler = Scheduler(aiohttp.ClientSession, backoff_base=0.01)
+            try:
+                with pytest.raises(FetchError):
+                    await scheduler.get_text(url)
+            finally:
+                await scheduler.close()
+            return len(requests)
+
+    assert asyncio.run(main()) == 1
+
+
+def test_connection_errors_raise_fetch_error():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]  # nothing listens on it once closed
+
+    with pytest.raises(FetchError) as error:
+        fetch(f"http://127.0.0.1:{port}/", max_retries=1)
+    assert error.value.status is None
+    assert isinstance(error.value.__cause__, aiohttp.ClientError)
+
+
+def test_host_limiter_is_aimd():
+    async def main():
+        limiter = _HostLimiter(4, min_limit=1, max_limit=8, cooldown=0.0)
+        for _ in range(4):
+            limiter.on_success(latency=0.1, target_latency=1.0)
+        grown = limiter.limit
+
+        limiter.on_throttle()
+        halved = limiter.limit
+
+        limiter.on_success(latency=2.0, target_latency=1.0)
+        return grown, halved, limiter.limit
+
+    grown, halved, slowed = asyncio.run(main())
+    assert 4.9 < grown < 5.0  # about one more request per window of fast responses
+    assert halved == grown / 2
+    assert slowed == pytest.approx(halved * 0.9)
+
+
+def test_host_limiter_decreases_once_per_cooldown():
+    async def main():
+        limiter = _HostLimiter(8, min_limit=1, max_limit=8, cooldown=60.0)
+        limiter.on_throttle()
+        limiter.on_throttle()
+        return limiter.limit
+
+    assert asyncio.run(main()) == 4
+
+
+def test_host_limiter_bounds_in_flight_requests():
+    async def main():
+        limiter = _HostLimiter(2, min_limit=1, max_limit=8)
+        in_flight = []
+
+        async def request():
+            async with limiter:
+                in_flight.append(limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*[request() for _ in range(6)])
+        return max(in_flight)
+
+    assert asyncio.run(main()) == 2
+
+
+def test_parse_retry_after():
+    assert _parse_retry_after("3") == 3.0
+    assert _parse_retry_after(None) is None
+    assert _parse_retry_after("soon") is None
+    assert _parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from forecast_store import ForecastStore
+
+snapshots = pytest.importorskip("snapshots")
+pytest.importorskip("pyarrow")
+
+
+def forecast(y_pred, day, page=1):
+    return {"y_pred": y_pred, "timestamp": f"2021-03-{day:02d}T12:00:00Z", "page": page}
+
+
+USER_DATA = [
+    ("10", [forecast([0.7, 0.3], 1), forecast([0.6, 0.4], 2, page=2)], {"y_true": [1, 0]}),
+    ("11", [], {"y_true": [0, 1]}),  # no forecasts
+    ("12", [forecast([0.2, 0.3, 0.5], 3)], {"y_true": [0, 0, 1]}),
+    ("13", [forecast([0.5, 0.5], 4)], {"y_true": [0, 0, 1]}),  # no forecast matches the options
+]
+
+
+@pytest.mark.parametrize("fmt", snapshots.FORMATS)
+def test_load_store_keeps_questions_without_forecasts(tmp_path, fmt):
+    snapshots.export_user_data({"7": USER_DATA}, str(tmp_path), "gjo", fmt)
+
+    expected = ForecastStore.from_stream(USER_DATA)
+    store = snapshots.load_store(str(tmp_path), "gjo", "7")
+
+    assert store.qids == expected.qids == ["10", "11", "12", "13"]
+    assert store.n_questions == expected.n_questions
+    for name in ["question_offsets", "forecast_offsets", "outcome", "timestamp"]:
+        assert np.array_equal(getattr(store, name), getattr(expected, name)), name
+    assert np.abs(store.probability - expected.probability).max() < 1e-12
+
+
+def test_read_user_records_keeps_questions_without_forecasts(tmp_path):
+    snapshots.export_user_data({"7": USER_DATA}, str(tmp_path), "gjo")
+
+    records = snapshots.read_user_records(str(tmp_path), "gjo", "7")
+
+    assert list(records) == ["10", "11", "12", "13"]
+    assert records["10"]["last_page"] == 2 and len(records["10"]["forecasts"]) == 2
+    assert records["11"] == records["13"] == {"forecasts": [], "last_page": 0, "complete": True}
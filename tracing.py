@@ -0,0 +1,209 @@
+"""
+Lightweight tracing of where the time of a run goes.
+
+    with tracing.start_trace("run") as trace:
+        with tracing.span("scrape.forecasts", qid=qid):
+            ...
+            tracing.annotate(pages=3)
+
+Spans are recorded only inside `start_trace`; elsewhere `span` and `annotate`
+cost a context variable lookup. The current trace and span follow the code
+through tasks; threads have to be started in a copy of the context (see
+`in_context`).
+"""
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import logging
+import sys
+import threading
+import time
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+_ids = itertools.count(1)
+
+# Spans are logged at INFO whatever the root level is (calibration.py leaves it
+# at WARNING), through a handler of their own.
+logger = logging.getLogger("tracing")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+# Numeric attributes which make no sense summed over spans.
+NOT_SUMMED = {"status"}
+
+
+class Span:
+    __slots__ = ("id", "parent", "name", "start", "end", "attributes")
+
+    def __init__(self, name, parent, attributes):
+        self.id = next(_ids)
+        self.parent = parent
+        self.name = name
+        self.start = time.perf_counter()
+        self.end = None
+        self.attributes = attributes
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def records(self):
+        """
+        One dict per span, times in seconds since the start of the trace.
+        """
+        return [
+            {
+                "trace": self.name,
+                "id": span.id,
+                "parent": span.parent,
+                "name": span.name,
+                "start": span.start - self.start,
+                "duration": span.duration,
+                **span.attributes,
+            }
+            for span in sorted(self.spans, key=lambda span: span.start)
+        ]
+
+    def summary(self):
+        """
+        {span name: {"count": ..., "seconds": ..., numeric attribute: sum, ...}}
+        """
+        summary = dict()
+        for span in self.spans:
+            entry = summary.setdefault(span.name, {"count": 0, "seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += span.duration
+            for key, value in span.attributes.items():
+                if key in NOT_SUMMED or not isinstance(value, (int, float)):
+                    continue
+                entry[key] = entry.get(key, 0) + value
+        return summary
+
+    def to_openmetrics(self, prefix="gjo_calibration"):
+        summary = sorted(self.summary().items())
+
+        lines = [f"# TYPE {prefix}_span_seconds summary", f"# UNIT {prefix}_span_seconds seconds"]
+        for name, entry in summary:
+            lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {entry["count"]}')
+            lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {entry["seconds"]:.6f}')
+
+        keys = sorted({key for _, entry in summary for key in entry} - {"count", "seconds"})
+        for key in keys:
+            lines.append(f"# TYPE {prefix}_span_{key} counter")
+            for name, entry in summary:
+                if key in entry:
+                    lines.append(f'{prefix}_span_{key}_total{{span="{name}"}} {entry[key]:g}')
+
+        lines.append("# EOF")
+        return "\n".join(lines)
+
+    def log(self):
+        for record in self.records():
+            logger.info(json.dumps(record, default=str))
+
+
+@contextlib.contextmanager
+def start_trace(name):
+    trace = Trace(name)
+    trace_token, span_token = _trace.set(trace), _span.set(None)
+    try:
+        yield trace
+    finally:
+        _trace.reset(trace_token)
+        _span.reset(span_token)
+
+
+def begin(name):
+    """
+    Starts a trace for the rest of the current context, for scripts which cannot
+    wrap themselves in `start_trace`.
+    """
+    trace = Trace(name)
+    _trace.set(trace)
+    _span.set(None)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _span.get()
+    current = Span(name, None if parent is None else parent.id, attributes)
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _span.reset(token)
+        trace.add(current)
+
+
+def annotate(**attributes):
+    """
+    Adds attributes to the current span, if any.
+    """
+    current = _span.get()
+    if current is not None and _trace.get() is not None:
+        current.attributes.update(attributes)
+
+
+def traced(name):
+    """
+    Records every call of the decorated function (or coroutine function) as a span.
+    """
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def in_context(func):
+    """
+    Binds `func` to a copy of the current context, so that spans it records from
+    another thread (or executor) land in the current trace.
+    """
+    return functools.partial(contextvars.copy_context().run, func)